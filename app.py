@@ -1,5 +1,31 @@
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
 import streamlit as st
-from pop_utils_web import parse_filename, generate_presentation_from_uploads
+from pop_batch import REPORT_FORMATS, generate_batch_zip, group_by_report
+from pop_images import (
+    DEFAULT_IMAGE_PRESET,
+    IMAGE_PRESETS,
+    Preprocessor,
+    ThumbnailCache,
+    probe_images,
+    source_digest,
+)
+from pop_pdf import generate_presentation_pdf
+from pop_trace import BuildTrace, PeakMemory, log_sink, prometheus_text
+from pop_utils_web import (
+    DEFAULT_PHOTO_LAYOUT,
+    PHOTO_LAYOUTS,
+    BuildCancelled,
+    ReportBuilder,
+    parse_photo_names,
+    resolve_photo_layout,
+    save_presentation,
+    warm_template_cache,
+)
 
 st.set_page_config(
     page_title="PoP Report Builder",
@@ -10,13 +36,103 @@ st.set_page_config(
 HEADER_URL = "https://raw.githubusercontent.com/phoebegawk/pop-report-builder/main/assets/Header-PoPReportBuilder.png"
 BG_URL = "https://raw.githubusercontent.com/phoebegawk/pop-report-builder/main/assets/PoPReportBuilder-BG.png"
 
+# Upload table rows shown per page
+TABLE_PAGE_SIZE = 50
+
+# Photo preview grid: columns, and total size of cached thumbnails
+PREVIEW_COLUMNS = 5
+PREVIEW_CACHE_BYTES = 32 * 1024 * 1024
+
+# How often the page refreshes while a report is building
+PROGRESS_POLL_SECONDS = 0.5
+# ... and while uploaded photos are still being prepared in the background
+PREPROCESS_POLL_SECONDS = 1.0
+
+PREPARED_LABELS = {
+    "queued": "⏳ Queued",
+    "preparing": "⚙️ Preparing",
+    "ready": "✅ Ready",
+    "failed": "⚠️ Failed",
+}
+
+# Resident memory a single-report build may use before spooling media to disk,
+# e.g. POP_MEMORY_BUDGET_MB=1024 to fit a container's limit (unset: no budget)
+MEMORY_BUDGET = int(os.environ.get("POP_MEMORY_BUDGET_MB", "0")) * 1024 * 1024 or None
+
+REPORT_FORMAT_LABELS = {"pptx": "PowerPoint (.pptx)", "pdf": "PDF"}
+PHOTO_LAYOUT_LABELS = {"single": "1", "2-up": "2", "4-up": "4", "6-up": "6"}
+# Finished reports are written here and deleted once this old, so decks from
+# sessions that never reset or re-generate don't pile up on disk
+REPORT_DIR = Path(tempfile.gettempdir()) / "pop_reports"
+REPORT_MAX_AGE = float(os.environ.get("POP_REPORT_MAX_AGE_HOURS", "6")) * 3600
+# How often expired reports are looked for
+REPORT_SWEEP_SECONDS = 300
+
+DOWNLOAD_MIME = {
+    ".pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    ".pdf": "application/pdf",
+    ".zip": "application/zip",
+}
+
+# ---------------------------
+# Template warm-up (once per server process)
+# ---------------------------
+@st.cache_resource
+def warm_template():
+    warm_template_cache()
+
+
+warm_template()
+
+# Thumbnails shared by every session in this server process
+@st.cache_resource
+def thumbnail_cache():
+    return ThumbnailCache(PREVIEW_CACHE_BYTES)
+
+
+def expire_reports():
+    cutoff = time.time() - REPORT_MAX_AGE
+    for path in REPORT_DIR.glob("pop_report_*"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            pass  # removed by its session in the meantime
+
+
+# Expired reports are swept by one thread per server process
+@st.cache_resource
+def report_sweeper():
+    def sweep():
+        while True:
+            expire_reports()
+            time.sleep(REPORT_SWEEP_SECONDS)
+
+    REPORT_DIR.mkdir(exist_ok=True)
+    thread = threading.Thread(target=sweep, name="pop-report-sweeper", daemon=True)
+    thread.start()
+    return thread
+
+
+report_sweeper()
+
+
 # ---------------------------
 # Session State Init
 # ---------------------------
 st.session_state.setdefault("uploader_key", 0)
 st.session_state.setdefault("reset_nonce", 0)
-st.session_state.setdefault("pptx_bytes", None)
+# finished deck lives on disk; only its path is kept in the session
+st.session_state.setdefault("pptx_path", None)
 st.session_state.setdefault("pptx_name", None)
+# last build, so regenerating after adding/removing photos only redoes the changes
+st.session_state.setdefault("report_builder", None)
+# report being built in the background (thread, progress, cancel event)
+st.session_state.setdefault("generation", None)
+# timings of the last single-report build, for the debug panel
+st.session_state.setdefault("last_trace", None)
+# prepares valid uploads in the background so Generate finds them ready
+st.session_state.setdefault("preprocessor", None)
 
 # overlay state
 st.session_state.setdefault("overlay_active", False)
@@ -24,14 +140,121 @@ st.session_state.setdefault("overlay_message", "Uploading…")
 st.session_state.setdefault("overlay_submessage", "Processing files and building the table.")
 # two-step parse trigger so overlay actually renders
 st.session_state.setdefault("pending_parse", False)
+# parsed upload table, reused across reruns until the uploads change
+st.session_state.setdefault("upload_table", None)
+st.session_state.setdefault("upload_rows", {})
+# content hash per upload, shared by the table probe, previews and the build
+st.session_state.setdefault("upload_digests", {})
 
 # ---------------------------
 # Callbacks
 # ---------------------------
-def reset_all():
-    st.session_state["pptx_bytes"] = None
+def discard_report():
+    path = st.session_state.get("pptx_path")
+    if path:
+        Path(path).unlink(missing_ok=True)
+    st.session_state["pptx_path"] = None
     st.session_state["pptx_name"] = None
 
+
+def cancel_generation():
+    job = st.session_state.get("generation")
+    if job is not None:
+        job["cancel"].set()
+
+
+def run_generation(
+    job, files, image_preset, report_format, photo_layout, builder, prepared=None, digests=None
+):
+    # Background thread: must not touch st.* or session state, only `job`
+    progress = job["progress"]
+    try:
+        if job["is_batch"]:
+
+            def on_deck(event):
+                if event["status"] != "queued":
+                    progress["slides_done"] += event["slides"]
+                progress["stage"] = "building"
+
+            _, results = generate_batch_zip(
+                files,
+                job["out_path"],
+                image_preset=image_preset,
+                progress=on_deck,
+                cancel=job["cancel"],
+                report_format=report_format,
+                photo_layout=photo_layout,
+            )
+            job["result"] = ("PoP Reports.zip", results)
+        elif report_format == "pdf":
+            trace = BuildTrace([log_sink])
+            _, pdf_name = generate_presentation_pdf(
+                files,
+                job["out_path"],
+                image_preset=image_preset,
+                progress=progress.update,
+                cancel=job["cancel"],
+                trace=trace,
+                photo_layout=photo_layout,
+            )
+            job["trace"] = trace
+            job["result"] = (pdf_name, [])
+        else:
+            trace = BuildTrace([log_sink])
+            with PeakMemory() as memory:
+                prs, pptx_name = builder.build(
+                    files,
+                    progress=progress.update,
+                    cancel=job["cancel"],
+                    trace=trace,
+                    prepared=prepared,
+                    digests=digests,
+                )
+                save_presentation(
+                    prs,
+                    job["out_path"],
+                    progress=progress.update,
+                    cancel=job["cancel"],
+                    trace=trace,
+                )
+            if memory.peak is not None:
+                trace.gauge("peak_rss_bytes", memory.peak)
+            job["trace"] = trace.finish()
+            job["result"] = (pptx_name, [])
+    except BuildCancelled:
+        pass
+    except Exception as e:
+        job["error"] = str(e)
+
+
+def close_preprocessor():
+    preprocessor = st.session_state.get("preprocessor")
+    if preprocessor is not None:
+        preprocessor.close()
+        st.session_state["preprocessor"] = None
+
+
+def preprocessor_for(image_preset, photo_layout):
+    """The session's Preprocessor, replaced if the photo quality or photo box changed."""
+    box_cm = resolve_photo_layout(photo_layout).box_cm
+    preprocessor = st.session_state["preprocessor"]
+    if preprocessor is None or (preprocessor.preset, preprocessor.box_cm) != (image_preset, box_cm):
+        close_preprocessor()
+        preprocessor = Preprocessor(box_cm, image_preset)
+        st.session_state["preprocessor"] = preprocessor
+    return preprocessor
+
+
+def reset_all():
+    cancel_generation()
+    close_preprocessor()
+    discard_report()
+    st.session_state["report_builder"] = None
+    st.session_state["last_trace"] = None
+    st.session_state["upload_table"] = None
+    st.session_state["upload_rows"] = {}
+    st.session_state["upload_digests"] = {}
+
     st.session_state["overlay_active"] = False
     st.session_state["pending_parse"] = False
 
@@ -42,8 +265,8 @@ def reset_all():
 
 def on_upload_change():
     # Fires after browser upload completes (Streamlit receives files)
-    st.session_state["pptx_bytes"] = None
-    st.session_state["pptx_name"] = None
+    cancel_generation()
+    discard_report()
 
     # Trigger overlay + two-step parse
     st.session_state["overlay_active"] = True
@@ -335,63 +558,186 @@ if st.session_state.get("pending_parse") and uploaded_files:
 # ---------------------------
 # Parse + Sort
 # ---------------------------
-valid_files = []
-file_rows = []
+def file_identity(f):
+    # Same upload across reruns; a re-upload of the same name gets a new file_id
+    return (f.name, f.size, getattr(f, "file_id", None))
 
-if uploaded_files:
-    # show overlay while parsing
-    st.session_state["overlay_active"] = True
-    st.session_state["overlay_message"] = "Uploading…"
-    st.session_state["overlay_submessage"] = "Building the table."
-    render_overlay()
 
-    try:
-        temp_rows = []
-        for f in uploaded_files:
-            info = parse_filename(f)
-
-            if info is None:
-                status = "❌ Invalid name"
-                parsed_date = None
-            else:
-                status = "✅"
-                valid_files.append(f)
-                parsed_date = info["live_date"]
-
-            temp_rows.append(
-                {
-                    "File": f.name,
-                    "Site": info["site_name"] if info else "-",
-                    "Client": info["client"] if info else "-",
-                    "Campaign": info["campaign"] if info else "-",
-                    "Live Date": info["live_date_display"] if info else "-",
-                    "Status": status,
-                    "_sort_date": parsed_date,
-                }
-            )
+def table_row(f, info, probe):
+    if not info.valid:
+        status = "❌ Invalid name"
+    elif probe is None:
+        status = "❌ Not a readable JPG/PNG"
+    else:
+        status = "✅"
+    return {
+        "File": f.name,
+        "Site": info.site_name if info.valid else "-",
+        "Client": info.client if info.valid else "-",
+        "Campaign": info.campaign if info.valid else "-",
+        "Live Date": info.live_date_display if info.valid else "-",
+        # Pixel size as the photo will appear, i.e. after EXIF rotation
+        "Size": "{} × {}".format(*probe.upright_size) if probe else "-",
+        "Status": status,
+    }
 
-        temp_rows.sort(key=lambda x: (x["_sort_date"] is None, x["_sort_date"]))
-        for r in temp_rows:
-            r.pop("_sort_date", None)
 
-        file_rows = temp_rows
+valid_files = []
+file_rows = []
+ordered_files = []
 
-    finally:
-        st.session_state["overlay_active"] = False
+if uploaded_files:
+    ids = [file_identity(f) for f in uploaded_files]
+    table = st.session_state["upload_table"]
+
+    if table is None or table["ids"] != ids:
+        # show overlay while parsing
+        st.session_state["overlay_active"] = True
+        st.session_state["overlay_message"] = "Uploading…"
+        st.session_state["overlay_submessage"] = "Building the table."
         render_overlay()
 
+        try:
+            # Only files not seen on an earlier rerun are parsed and probed
+            cached = st.session_state["upload_rows"]
+            entries = {file_id: cached[file_id] for file_id in ids if file_id in cached}
+            new = [(file_id, f) for file_id, f in zip(ids, uploaded_files) if file_id not in entries]
+            new_files = [f for _, f in new]
+            # Hashed once per upload: probes are cached by content, and the
+            # background preparation and the build reuse both
+            digests = st.session_state["upload_digests"]
+            for file_id, f in new:
+                digests[file_id] = source_digest(f)
+            probes = probe_images(new_files, [digests[file_id] for file_id, _ in new])
+            for (file_id, f), info, probe in zip(new, parse_photo_names(new_files), probes):
+                ok = info.valid and probe is not None
+                entries[file_id] = ((not ok, info.sort_key), ok, table_row(f, info, probe))
+            st.session_state["upload_rows"] = entries
+
+            order = sorted(range(len(ids)), key=lambda i: entries[ids[i]][0])
+            table = {
+                "ids": ids,
+                "rows": [entries[ids[i]][2] for i in order],
+                "order": order,
+                "valid": [i for i in order if entries[ids[i]][1]],
+            }
+            st.session_state["upload_table"] = table
+
+        finally:
+            st.session_state["overlay_active"] = False
+            render_overlay()
+
+    # Same ids in the same order, so positions map onto this run's UploadedFiles
+    valid_files = [uploaded_files[i] for i in table["valid"]]
+    file_rows = table["rows"]
+    ordered_files = [uploaded_files[i] for i in table["order"]]
+
+    # Start preparing photos now, while the user checks the table. Skipped under a memory
+    # budget: the preprocessor keeps every prepared photo in memory.
+    if MEMORY_BUDGET is None and valid_files:
+        # The choices below, as last rendered
+        nonce = st.session_state["reset_nonce"]
+        preset = st.session_state.get(f"image_preset_{nonce}", DEFAULT_IMAGE_PRESET)
+        layout = st.session_state.get(f"photo_layout_{nonce}", DEFAULT_PHOTO_LAYOUT)
+        preprocessor_for(preset, layout).submit(
+            ((file_identity(f), f) for f in valid_files), st.session_state["upload_digests"]
+        )
+else:
+    close_preprocessor()
+
+preprocessor = st.session_state["preprocessor"]
+
 # ---------------------------
 # Show Table
 # ---------------------------
 if file_rows:
-    st.table(file_rows)
+    # Large uploads are shown a page at a time so reruns stay light
+    pages = -(-len(file_rows) // TABLE_PAGE_SIZE)
+    page = 1
+    if pages > 1:
+        _, page_col, _ = st.columns([3, 4.25, 3])
+        with page_col:
+            page = st.number_input(
+                f"Page (of {pages})",
+                min_value=1,
+                max_value=pages,
+                value=1,
+                key=f"table_page_{st.session_state['uploader_key']}",
+            )
+    first = (page - 1) * TABLE_PAGE_SIZE
+    page_rows = file_rows[first : first + TABLE_PAGE_SIZE]
+    if preprocessor is not None:
+        # Copies: the cached rows stay as parsed
+        page_files = ordered_files[first : first + TABLE_PAGE_SIZE]
+        page_rows = [
+            {**row, "Prepared": PREPARED_LABELS.get(preprocessor.status(file_identity(f)), "-")}
+            for row, f in zip(page_rows, page_files)
+        ]
+    st.table(page_rows)
+    if preprocessor is not None and preprocessor.busy():
+        counts = preprocessor.counts()
+        st.caption(
+            f"Preparing photos in the background: {counts.get('ready', 0)} of "
+            f"{sum(counts.values())} ready."
+        )
+    if pages > 1:
+        invalid = len(file_rows) - len(valid_files)
+        st.caption(
+            f"Showing {first + 1}–{min(first + TABLE_PAGE_SIZE, len(file_rows))} of "
+            f"{len(file_rows)} files ({invalid} invalid, listed last)."
+        )
+
+    # Thumbnails only for the files on this page, made on first view
+    if st.checkbox("Show photo previews", key=f"show_previews_{st.session_state['uploader_key']}"):
+        thumbnails = thumbnail_cache()
+        digests = st.session_state["upload_digests"]
+        preview_cols = st.columns(PREVIEW_COLUMNS)
+        for n, f in enumerate(ordered_files[first : first + TABLE_PAGE_SIZE]):
+            file_id = file_identity(f)
+            thumb = thumbnails.get(f, digests[file_id])
+            with preview_cols[n % PREVIEW_COLUMNS]:
+                if thumb is not None:
+                    st.image(thumb, caption=f.name, use_container_width=True)
+                else:
+                    st.caption(f"{f.name}: preview unavailable")
 
 # ---------------------------
-# Buttons
+# Photo quality
 # ---------------------------
-generate_disabled = not valid_files
 nonce = st.session_state["reset_nonce"]
 
+_, quality_col, layout_col, format_col, _ = st.columns([2.5, 2.25, 1.5, 1.75, 2.5])
+with quality_col:
+    image_preset = st.selectbox(
+        "Photo quality",
+        options=list(IMAGE_PRESETS),
+        index=list(IMAGE_PRESETS).index(DEFAULT_IMAGE_PRESET),
+        format_func=lambda name: name.capitalize(),
+        help="Photos are downscaled to the slide's display size. 'Original' embeds them untouched.",
+        key=f"image_preset_{nonce}",
+    )
+with layout_col:
+    photo_layout = st.selectbox(
+        "Photos per slide",
+        options=list(PHOTO_LAYOUTS),
+        format_func=PHOTO_LAYOUT_LABELS.get,
+        help="Large campaigns fit on fewer slides with several photos per slide.",
+        key=f"photo_layout_{nonce}",
+    )
+with format_col:
+    report_format = st.selectbox(
+        "Format",
+        options=list(REPORT_FORMATS),
+        format_func=REPORT_FORMAT_LABELS.get,
+        help="PDF pages are drawn directly, without PowerPoint, in a standard font.",
+        key=f"report_format_{nonce}",
+    )
+
+# ---------------------------
+# Buttons
+# ---------------------------
+generate_disabled = not valid_files or st.session_state["generation"] is not None
+
 left_spacer, col1, gap, col2, right_spacer = st.columns([3, 2, 0.25, 2, 3], gap="large")
 
 with col1:
@@ -403,10 +749,10 @@ with col1:
         key=f"generate_report_btn_{nonce}",
     )
     # Explain WHY it's disabled (so it doesn’t feel broken)
-    if uploaded_files and generate_disabled:
+    if uploaded_files and not valid_files:
         st.markdown(
             "<div style='text-align:center; font-weight:600; color:#FFFFFF; margin-top:10px;'>"
-            "Generate is disabled because none of the filenames match the required convention."
+            "Generate is disabled because none of the files are correctly named, readable photos."
             "</div>",
             unsafe_allow_html=True,
         )
@@ -423,35 +769,177 @@ with col2:
 # ---------------------------
 # Generation
 # ---------------------------
-if generate and valid_files:
-    st.session_state["overlay_active"] = True
-    st.session_state["overlay_message"] = "Building report…"
-    st.session_state["overlay_submessage"] = "Generating your PowerPoint."
-    render_overlay()
+if generate and valid_files and st.session_state["generation"] is None:
+    # Uploads spanning several client/campaign/months get one deck each, zipped
+    is_batch = len(group_by_report(valid_files)) > 1
+
+    builder = st.session_state["report_builder"]
+    if not is_batch and (
+        builder is None
+        or builder.image_preset != image_preset
+        or builder.photo_layout != photo_layout
+    ):
+        builder = ReportBuilder(
+            image_preset, memory_budget=MEMORY_BUDGET, photo_layout=photo_layout
+        )
+        st.session_state["report_builder"] = builder
+
+    # Photos prepared in the background at the chosen quality and size are reused as they are
+    prepared = None
+    if not is_batch and report_format == "pptx" and preprocessor is not None:
+        box_cm = resolve_photo_layout(photo_layout).box_cm
+        if (preprocessor.preset, preprocessor.box_cm) == (image_preset, box_cm):
+            prepared = preprocessor.prepared()
+
+    digests = st.session_state["upload_digests"]
+    digests = {f: digests.get(file_identity(f)) for f in valid_files}
+
+    discard_report()
+    suffix = ".zip" if is_batch else f".{report_format}"
+    REPORT_DIR.mkdir(exist_ok=True)
+    fd, out_path = tempfile.mkstemp(prefix="pop_report_", suffix=suffix, dir=REPORT_DIR)
+    os.close(fd)
+
+    # Runs on a background thread; each rerun below just reads its progress
+    job = {
+        "is_batch": is_batch,
+        "out_path": out_path,
+        "cancel": threading.Event(),
+        "progress": {
+            "stage": "preparing",
+            "slides_done": 0,
+            "slides_total": len(valid_files),
+            "bytes_written": 0,
+        },
+        "result": None,
+        "error": None,
+        "trace": None,
+    }
+    job["thread"] = threading.Thread(
+        target=run_generation,
+        args=(
+            job,
+            list(valid_files),
+            image_preset,
+            report_format,
+            photo_layout,
+            builder,
+            prepared,
+            digests,
+        ),
+        name="pop-generate",
+        daemon=True,
+    )
+    job["thread"].start()
+    st.session_state["generation"] = job
+
+job = st.session_state["generation"]
+if job is not None and job["thread"].is_alive():
+    progress = job["progress"]
+    total = max(progress["slides_total"], 1)
+    if job["cancel"].is_set():
+        label = "Cancelling…"
+    elif progress["stage"] == "saving":
+        label = f"Saving… {progress['bytes_written'] / (1024 * 1024):.1f} MB written"
+    elif progress["stage"] == "preparing":
+        label = "Preparing photos…"
+    else:
+        label = f"Building slides… {progress['slides_done']} of {progress['slides_total']} photos"
+
+    _, progress_col, cancel_col, _ = st.columns([3, 3.25, 1, 3])
+    with progress_col:
+        st.progress(min(progress["slides_done"] / total, 1.0), text=label)
+    with cancel_col:
+        st.button(
+            "Cancel",
+            type="secondary",
+            use_container_width=True,
+            disabled=job["cancel"].is_set(),
+            key=f"cancel_btn_{nonce}",
+            on_click=cancel_generation,
+        )
 
-    try:
-        pptx_bytes, pptx_name = generate_presentation_from_uploads(valid_files)
-        st.session_state["pptx_bytes"] = pptx_bytes
+    time.sleep(PROGRESS_POLL_SECONDS)
+    st.rerun()
+
+elif job is not None:
+    st.session_state["generation"] = None
+    if job["error"] is not None or job["cancel"].is_set():
+        Path(job["out_path"]).unlink(missing_ok=True)
+
+    if job["cancel"].is_set():
+        # Drop the half-built deck so its memory goes with it
+        st.session_state["report_builder"] = None
+        st.info("Report generation cancelled.")
+    elif job["error"] is not None:
+        st.error(f"Something went wrong while building the report: {job['error']}")
+    else:
+        pptx_name, results = job["result"]
+        st.session_state["last_trace"] = job["trace"]
+        st.session_state["pptx_path"] = job["out_path"]
         st.session_state["pptx_name"] = pptx_name
-        st.success("PoP Report generated successfully.")
-    except Exception as e:
-        st.session_state["pptx_bytes"] = None
-        st.session_state["pptx_name"] = None
-        st.error(f"Something went wrong while building the report: {e}")
-    finally:
-        st.session_state["overlay_active"] = False
-        render_overlay()
+        failed = [r for r in results if r["error"]]
+        if failed:
+            st.error(
+                "Some reports could not be built: "
+                + "; ".join(f"{r['name']}: {r['error']}" for r in failed)
+            )
+        elif job["is_batch"]:
+            st.success(f"{len(results)} PoP Reports generated successfully.")
+        else:
+            st.success("PoP Report generated successfully.")
 
 # ---------------------------
 # Download
 # ---------------------------
-if st.session_state["pptx_bytes"] is not None:
+if st.session_state["pptx_path"] is not None and Path(st.session_state["pptx_path"]).exists():
+    # The file is only read when the button is clicked, not on every rerun that draws it
+    report_path = Path(st.session_state["pptx_path"])
+    suffix = report_path.suffix
     st.download_button(
-        "Download PoP Report",
-        data=st.session_state["pptx_bytes"],
-        file_name=st.session_state["pptx_name"] or "PoP_Report.pptx",
-        mime="application/vnd.openxmlformats-officedocument.presentationml.presentation",
+        "Download PoP Reports (ZIP)" if suffix == ".zip" else "Download PoP Report",
+        data=report_path.read_bytes,
+        file_name=st.session_state["pptx_name"] or f"PoP_Report{suffix}",
+        mime=DOWNLOAD_MIME[suffix],
         type="primary",
         use_container_width=False,
         key=f"download_btn_{nonce}",
     )
+
+# ---------------------------
+# Debug: timings of the last build
+# ---------------------------
+trace = st.session_state["last_trace"]
+if trace is not None:
+    with st.expander("Build timings (debug)"):
+        stages = trace.stages()
+        total = sum(stages.values()) or 1
+        st.table(
+            [
+                {"Stage": name, "Seconds": f"{seconds:.3f}", "Share": f"{seconds / total:.0%}"}
+                for name, seconds in stages.items()
+            ]
+        )
+        histograms = trace.histograms()
+        if histograms:
+            st.table(
+                [
+                    {
+                        "Per slide": name,
+                        "Count": h["count"],
+                        "Mean ms": f"{h['mean'] * 1000:.1f}",
+                        "p50 ms": f"{h['p50'] * 1000:.1f}",
+                        "p90 ms": f"{h['p90'] * 1000:.1f}",
+                        "p99 ms": f"{h['p99'] * 1000:.1f}",
+                        "Max ms": f"{h['max'] * 1000:.1f}",
+                    }
+                    for name, h in histograms.items()
+                ]
+            )
+        st.json({"counters": trace.counters, "gauges": trace.gauges})
+        st.code(prometheus_text(trace), language="text")
+
+# Refresh the Prepared column until the background preparation settles
+if preprocessor is not None and preprocessor.busy() and st.session_state["generation"] is None:
+    time.sleep(PREPROCESS_POLL_SECONDS)
+    st.rerun()
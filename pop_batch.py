@@ -0,0 +1,257 @@
+from pathlib import Path
+import os
+import tempfile
+import threading
+import zipfile
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import BinaryIO, Callable, List, Tuple
+
+from pop_images import DEFAULT_IMAGE_PRESET, portable_source, process_pool, resolve_preset
+from pop_pdf import generate_presentation_pdf
+from pop_utils_web import (
+    SPOOL_MAX_BYTES,
+    DEFAULT_PHOTO_LAYOUT,
+    BuildCancelled,
+    collect_images,
+    generate_presentation_file,
+    parse_photo_name,
+    parse_photo_names,
+    report_filename,
+    resolve_photo_layout,
+)
+
+# Formats a report can be built in, by file suffix
+REPORT_FORMATS = ("pptx", "pdf")
+
+
+def group_by_report(image_paths) -> dict:
+    """
+    Split photos into one group per report: (client, campaign, month_year).
+    Groups come out in the order of their earliest photo; photos with invalid
+    names are left out.
+    """
+    groups: dict = {}
+    sources = collect_images(image_paths)
+    for source, info in zip(sources, parse_photo_names(sources)):
+        if info.valid:
+            groups.setdefault(info.report_key, []).append(source)
+    return groups
+
+
+def deck_names(groups: dict, report_format: str = "pptx") -> dict:
+    """
+    ZIP entry name per group: the usual report name, with the campaign added
+    for groups that would otherwise share one (same client and month).
+    """
+    names = {
+        key: Path(report_filename(parse_photo_name(sources[0]))).stem
+        for key, sources in groups.items()
+    }
+    clashes = Counter(names.values())
+    for (client, campaign, month_year), name in names.items():
+        if clashes[name] > 1:
+            name = f"{name} - {campaign}"
+        names[(client, campaign, month_year)] = f"{name}.{report_format}"
+    return names
+
+
+def _build_group(
+    sources: list, out_path: str, image_preset, report_format: str, photo_layout, workers: int
+) -> None:
+    # Runs in a worker process, preparing photos on its share of the CPUs
+    build = generate_presentation_pdf if report_format == "pdf" else generate_presentation_file
+    build(sources, out_path, image_preset=image_preset, workers=workers, photo_layout=photo_layout)
+
+
+def generate_batch_zip(
+    image_paths: List[Path],
+    out=None,
+    image_preset=DEFAULT_IMAGE_PRESET,
+    jobs: int | None = None,
+    progress: Callable[[dict], None] | None = None,
+    cancel: threading.Event | None = None,
+    report_format: str = "pptx",
+    photo_layout=DEFAULT_PHOTO_LAYOUT,
+) -> Tuple[BinaryIO | Path, list]:
+    """
+    Build one deck per (client, campaign, month) on `jobs` CPUs (default: all)
+    and stream them into a ZIP as each one finishes. Up to `jobs` decks are
+    built at once, each preparing its photos on an equal share of the CPUs.
+
+    `out` works as in `generate_presentation_file`, and decks are named by
+    `deck_names`. `progress` receives a dict per deck event with "deck",
+    "status" ("queued", "done" or "failed"), "slides", "done" and "total".
+    A failed deck doesn't stop the others. Returns (out, results), with one
+    result dict per deck: "name", "client", "campaign", "month_year",
+    "slides" and "error" (None on success).
+
+    Setting `cancel` drops the decks not yet started, waits for the ones in
+    progress and raises BuildCancelled. `report_format` is "pptx" or "pdf"
+    (see `generate_presentation_pdf`), and `photo_layout` sets how many photos
+    share a slide (see PHOTO_LAYOUTS).
+    """
+    groups = _groups_to_build(image_paths, image_preset, report_format, photo_layout)
+    if out is None:
+        out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, suffix=".zip")
+
+    # Each deck is written to its own file in a per-job staging directory
+    # and moved into the ZIP as soon as it is finished
+    results: list = []
+    with tempfile.TemporaryDirectory(prefix="pop_batch_") as staging, zipfile.ZipFile(
+        out if not isinstance(out, (str, Path)) else str(out), "w", zipfile.ZIP_STORED
+    ) as zf:
+        built = _build_groups(
+            groups,
+            staging,
+            image_preset,
+            report_format,
+            photo_layout,
+            jobs,
+            progress,
+            cancel,
+            results,
+        )
+        for result, deck_path in built:
+            zf.write(deck_path, arcname=result["name"])
+            os.remove(deck_path)
+
+    if isinstance(out, (str, Path)):
+        out = Path(out)
+    elif out.seekable():
+        out.seek(0)
+    return out, results
+
+
+def generate_batch_dir(
+    image_paths: List[Path],
+    out_dir,
+    image_preset=DEFAULT_IMAGE_PRESET,
+    jobs: int | None = None,
+    progress: Callable[[dict], None] | None = None,
+    cancel: threading.Event | None = None,
+    report_format: str = "pptx",
+    photo_layout=DEFAULT_PHOTO_LAYOUT,
+) -> list:
+    """
+    Same as `generate_batch_zip`, but writes each deck into `out_dir`.
+    Decks are staged next to their destination and renamed into place, so a
+    half-written deck never shows up under its final name. Returns the results.
+    """
+    groups = _groups_to_build(image_paths, image_preset, report_format, photo_layout)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    results: list = []
+    with tempfile.TemporaryDirectory(prefix=".pop_batch_", dir=out_dir) as staging:
+        built = _build_groups(
+            groups,
+            staging,
+            image_preset,
+            report_format,
+            photo_layout,
+            jobs,
+            progress,
+            cancel,
+            results,
+        )
+        for result, deck_path in built:
+            os.replace(deck_path, out_dir / result["name"])
+    return results
+
+
+def _groups_to_build(image_paths, image_preset, report_format, photo_layout) -> dict:
+    resolve_preset(image_preset)
+    resolve_photo_layout(photo_layout)
+    if report_format not in REPORT_FORMATS:
+        raise ValueError(
+            f"Unknown report format {report_format!r}. Choose one of: {', '.join(REPORT_FORMATS)}."
+        )
+    groups = group_by_report(image_paths)
+    if not groups:
+        raise ValueError("No validly named photos found; nothing to build.")
+    return groups
+
+
+def _build_groups(
+    groups: dict,
+    staging: str,
+    image_preset,
+    report_format,
+    photo_layout,
+    jobs,
+    progress,
+    cancel,
+    results: list,
+):
+    """
+    Build every group on a process pool, appending a result dict per group to
+    `results` and yielding (result, deck_path) for each deck as it finishes.
+    """
+    names = deck_names(groups, report_format)
+    cpus = jobs or os.cpu_count() or 1
+    # Decks built at once split the CPUs between them, so one big campaign
+    # still prepares its photos on all of them
+    jobs = min(cpus, len(groups))
+    workers = max(1, cpus // len(groups))
+    finished = 0
+
+    def report(result: dict, status: str) -> None:
+        if progress:
+            progress(
+                {
+                    "deck": result["name"],
+                    "status": status,
+                    "slides": result["slides"],
+                    "done": finished,
+                    "total": len(groups),
+                }
+            )
+
+    with process_pool(jobs) as pool:
+        futures = {}
+        for idx, ((client, campaign, month_year), sources) in enumerate(groups.items()):
+            result = {
+                "name": names[(client, campaign, month_year)],
+                "client": client,
+                "campaign": campaign,
+                "month_year": month_year,
+                "slides": len(sources),
+                "error": None,
+            }
+            results.append(result)
+            deck_path = os.path.join(staging, f"deck_{idx}.{report_format}")
+            future = pool.submit(
+                _build_group,
+                [portable_source(s) for s in sources],
+                deck_path,
+                image_preset,
+                report_format,
+                photo_layout,
+                workers,
+            )
+            futures[future] = (result, deck_path)
+            report(result, "queued")
+
+        pending = set(futures)
+        while pending:
+            # Wake up regularly so a cancel is noticed between decks
+            completed, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            if cancel is not None and cancel.is_set():
+                for future in pending:
+                    future.cancel()
+                wait(pending)
+                raise BuildCancelled("Build cancelled.")
+
+            for future in completed:
+                result, deck_path = futures[future]
+                finished += 1
+                try:
+                    future.result()
+                except Exception as e:
+                    result["error"] = str(e)
+                    report(result, "failed")
+                    continue
+
+                yield result, deck_path
+                report(result, "done")
@@ -0,0 +1,429 @@
+from pathlib import Path
+from datetime import datetime, timedelta
+from PIL import Image, ImageDraw
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from contextlib import contextmanager
+from typing import List, Tuple
+
+import pop_utils_web
+from pop_images import DEFAULT_IMAGE_PRESET, IMAGE_PRESETS, NamedBuffer
+from pop_trace import BuildTrace
+from pop_utils_web import (
+    DEFAULT_PHOTO_LAYOUT,
+    PHOTO_LAYOUTS,
+    ReportBuilder,
+    extract_live_date_priority,
+    generate_presentation_file,
+    parse_photo_names,
+    save_presentation,
+)
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+DEFAULT_CORPUS_DIR = SCRIPT_DIR / ".bench_corpus"
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
+
+# Order the stages run (and are reported) in. Scan, parse and sort are timed
+# here; the rest come from the build's BuildTrace: "prepare" is the time
+# slides waited for their photos, "stamp" the time spent stamping (and, when
+# sharded, merging) them.
+STAGES = ("scan", "parse", "sort", "template_load", "hash", "prepare", "stamp", "save")
+
+# Memoised filename and date parsing, emptied before the stages that use it
+_NAME_CACHES = (
+    pop_utils_web._parse_name,
+    pop_utils_web._live_date,
+    pop_utils_web.convert_date,
+    pop_utils_web.display_date,
+)
+
+
+def make_corpus(
+    out_dir: Path,
+    count: int,
+    size: Tuple[int, int] = (1600, 1200),
+    png_ratio: float = 0.0,
+    first_date: datetime = datetime(2026, 3, 1),
+) -> Path:
+    """
+    Write `count` correctly named photos of `size` pixels into `out_dir`, a
+    `png_ratio` share of them as PNG. Every photo is different (so none are
+    deduplicated) and their live dates spread over four weeks. An existing
+    complete corpus is reused.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    marker = out_dir / ".complete"
+    if marker.exists():
+        return out_dir
+
+    base = Image.merge(
+        "RGB",
+        (
+            Image.linear_gradient("L").resize(size),
+            Image.linear_gradient("L").rotate(90).resize(size),
+            Image.effect_noise(size, 40),
+        ),
+    )
+    block = (size[0] // 4, size[1] // 4)
+    png_every = round(1 / png_ratio) if png_ratio > 0 else 0
+
+    for i in range(count):
+        img = base.copy()
+        draw = ImageDraw.Draw(img)
+        x = (i * 97) % (size[0] - block[0])
+        y = (i * 53) % (size[1] - block[1])
+        colour = ((i * 37) % 256, (i * 91) % 256, 128)
+        draw.rectangle((x, y, x + block[0], y + block[1]), fill=colour)
+        draw.text((x + 10, y + 10), f"#{i}", fill=(255, 255, 255))
+
+        live = (first_date + timedelta(days=i % 28)).strftime("%d%m%y")
+        kind = "Cam" if i % 2 else "Mock"
+        is_png = png_every and i % png_every == 0
+        name = f"Site {i} - SC{i:05d} - Bench Client - Bench Campaign - {live} - {kind}"
+        if is_png:
+            img.save(out_dir / f"{name}.png", format="PNG")
+        else:
+            img.save(out_dir / f"{name}.jpg", format="JPEG", quality=90)
+
+    marker.touch()
+    return out_dir
+
+
+def corpus_path(root: Path, count: int, size: Tuple[int, int], png_ratio: float) -> Path:
+    return root / f"n{count}_{size[0]}x{size[1]}_png{round(png_ratio * 100)}"
+
+
+@contextmanager
+def _timer(stages: dict, name: str):
+    started = time.perf_counter()
+    yield
+    stages[name] = round(time.perf_counter() - started, 4)
+
+
+def _cold_names() -> None:
+    for cache in _NAME_CACHES:
+        cache.cache_clear()
+
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_case(
+    corpus: Path,
+    image_preset,
+    workers: int | None,
+    shards: int | None = None,
+    photo_layout=DEFAULT_PHOTO_LAYOUT,
+) -> dict:
+    """Time every stage of one build over `corpus`. Run in a fresh process for honest peak RSS."""
+    stages: dict = {}
+    with _timer(stages, "scan"):
+        files = [p for p in corpus.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES]
+
+    # Each stage starts cold, as it would if it ran first
+    _cold_names()
+    with _timer(stages, "parse"):
+        parse_photo_names(files)
+    _cold_names()
+    with _timer(stages, "sort"):
+        files.sort(key=extract_live_date_priority)
+
+    builder = ReportBuilder(image_preset, workers, shards, photo_layout=photo_layout)
+    trace = BuildTrace()
+    started = time.perf_counter()
+    prs, _ = builder.build(files, trace=trace)
+    build_seconds = time.perf_counter() - started
+    with tempfile.TemporaryDirectory(prefix="pop_bench_") as tmp:
+        out = save_presentation(prs, Path(tmp) / "bench.pptx", trace=trace)
+        output_bytes = out.stat().st_size
+
+    spans = trace.stages()
+    samples = {name: sum(values) for name, values in trace.samples.items()}
+    stages["template_load"] = round(spans.get("template_load", 0), 4)
+    stages["hash"] = round(spans.get("hash", 0), 4)
+    stages["prepare"] = round(samples.get("prepare_image", 0), 4)
+    stages["stamp"] = round(samples.get("stamp_slide", 0) + samples.get("merge_slide", 0), 4)
+    stages["save"] = round(spans["save"], 4)
+
+    return {
+        "photos": len(files),
+        "input_bytes": sum(p.stat().st_size for p in files),
+        "output_bytes": output_bytes,
+        "stages": stages,
+        "total": round(sum(stages.values()), 4),
+        # All of ReportBuilder.build, including waits on shards that no stage covers
+        "build_seconds": round(build_seconds, 4),
+        "peak_rss_mb": _peak_rss_mb(),
+        "workers_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=SCRIPT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(
+    counts: List[int],
+    size: Tuple[int, int],
+    png_ratio: float,
+    image_preset,
+    workers: int | None,
+    corpus_root: Path,
+    shards: int | None = None,
+    photo_layout=DEFAULT_PHOTO_LAYOUT,
+) -> dict:
+    cases = []
+    for count in counts:
+        corpus = corpus_path(corpus_root, count, size, png_ratio)
+        print(f"Corpus of {count} photos: {corpus}", file=sys.stderr)
+        make_corpus(corpus, count, size, png_ratio)
+
+        # Each case gets its own interpreter so peak RSS and caches start clean
+        cmd = [sys.executable, __file__, "_case", str(corpus), "--preset", image_preset]
+        if workers:
+            cmd += ["--workers", str(workers)]
+        if shards:
+            cmd += ["--shards", str(shards)]
+        cmd += ["--layout", photo_layout]
+        proc = subprocess.run(cmd, capture_output=True, text=True, cwd=SCRIPT_DIR)
+        if proc.returncode != 0:
+            raise RuntimeError(f"Benchmark of {count} photos failed:\n{proc.stderr}")
+
+        case = {"count": count, **json.loads(proc.stdout.splitlines()[-1])}
+        cases.append(case)
+        print(
+            f"  {count:>6} photos  total {case['total']:8.2f}s  "
+            + "  ".join(f"{s} {case['stages'][s]:.2f}s" for s in STAGES)
+            + f"  peak {case['peak_rss_mb']} MB  out {case['output_bytes'] / 1e6:.1f} MB",
+            file=sys.stderr,
+        )
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {
+            "size": list(size),
+            "png_ratio": png_ratio,
+            "image_preset": image_preset,
+            "workers": workers,
+            "shards": shards,
+            "photo_layout": photo_layout,
+        },
+        "cases": cases,
+    }
+
+
+def compare(baseline: dict, current: dict) -> None:
+    """Print each stage's time relative to `baseline` (a previous results file)."""
+    before = {case["count"]: case for case in baseline["cases"]}
+    print(f"Compared with {baseline.get('commit') or 'baseline'} ({baseline['timestamp']}):")
+    for case in current["cases"]:
+        old = before.get(case["count"])
+        if old is None:
+            continue
+        ratios = [
+            f"{stage} x{case['stages'][stage] / old['stages'][stage]:.2f}"
+            for stage in STAGES
+            if old["stages"].get(stage)
+        ]
+        print(
+            f"  {case['count']:>6} photos  total x{case['total'] / old['total']:.2f}  "
+            + "  ".join(ratios)
+            + f"  peak {old['peak_rss_mb']} -> {case['peak_rss_mb']} MB"
+        )
+
+
+def deck_differences(a: Path, b: Path) -> List[str]:
+    """Names of the parts that differ between two decks, or exist in only one."""
+    with zipfile.ZipFile(a) as za, zipfile.ZipFile(b) as zb:
+        names_a, names_b = za.namelist(), zb.namelist()
+        if names_a != names_b:
+            return sorted(set(names_a) ^ set(names_b)) or ["[part order]"]
+        return [name for name in names_a if za.read(name) != zb.read(name)]
+
+
+def verify_builds(
+    corpus: Path, image_preset, layouts: List[str], workers: int | None = None
+) -> dict:
+    """
+    Build `corpus` (plus a renamed copy of its first photo, to exercise media
+    deduplication) the plain way, on one process with no budget, and then
+    pooled, sharded and memory-budgeted; the last three must match the first
+    part for part. Returns {layout: {mode: [differing parts]}}.
+    """
+    files = sorted(p for p in corpus.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+    first = files[0]
+    live = pop_utils_web.parse_photo_name(first).live_date
+    duplicate = f"Site Dup - SC99999 - Bench Client - Bench Campaign - {live} - Cam{first.suffix}"
+    sources = [*files, NamedBuffer(duplicate, first.read_bytes())]
+
+    modes = {
+        "pooled": {"workers": max(2, workers or os.cpu_count() or 1)},
+        "sharded": {"workers": workers, "shards": 2},
+        "budgeted": {"memory_budget": 1},  # every photo is spooled to disk
+    }
+    # Shards only start at SHARD_MIN_SLIDES slides; lowered so a small corpus is sharded
+    min_slides = pop_utils_web.SHARD_MIN_SLIDES
+    pop_utils_web.SHARD_MIN_SLIDES = 1
+    results: dict = {}
+    try:
+        with tempfile.TemporaryDirectory(prefix="pop_verify_") as tmp:
+            for layout in layouts:
+                plain = Path(tmp) / f"{layout}-plain.pptx"
+                generate_presentation_file(sources, plain, image_preset, 1, photo_layout=layout)
+                results[layout] = {}
+                for mode, options in modes.items():
+                    out = Path(tmp) / f"{layout}-{mode}.pptx"
+                    generate_presentation_file(
+                        sources, out, image_preset, photo_layout=layout, **options
+                    )
+                    results[layout][mode] = deck_differences(plain, out)
+    finally:
+        pop_utils_web.SHARD_MIN_SLIDES = min_slides
+    return results
+
+
+def _size(text: str) -> Tuple[int, int]:
+    w, _, h = text.lower().partition("x")
+    return int(w), int(h)
+
+
+def main(argv: List[str] | None = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["_case"]:
+        case = argparse.ArgumentParser()
+        case.add_argument("corpus", type=Path)
+        case.add_argument("--preset", default=DEFAULT_IMAGE_PRESET)
+        case.add_argument("--workers", type=int, default=None)
+        case.add_argument("--shards", type=int, default=None)
+        case.add_argument("--layout", default=DEFAULT_PHOTO_LAYOUT)
+        args = case.parse_args(argv[1:])
+        print(
+            json.dumps(run_case(args.corpus, args.preset, args.workers, args.shards, args.layout))
+        )
+        return 0
+    if argv[:1] == ["verify"]:
+        return cmd_verify(argv[1:])
+
+    parser = argparse.ArgumentParser(
+        prog="pop_bench.py",
+        description="Benchmark PoP report generation on synthetic photo corpora. "
+        "'pop_bench.py verify' checks that every build mode writes the same deck.",
+    )
+    parser.add_argument(
+        "--counts",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000],
+        help="corpus sizes (e.g. 10 100 1000 5000)",
+    )
+    parser.add_argument(
+        "--size", type=_size, default=(1600, 1200), help="photo size, WxH (default: 1600x1200)"
+    )
+    parser.add_argument("--png-ratio", type=float, default=0.1, help="share of PNG photos (default: 0.1)")
+    parser.add_argument("--preset", choices=list(IMAGE_PRESETS), default=DEFAULT_IMAGE_PRESET)
+    parser.add_argument("-j", "--workers", type=int, default=None, help="photo workers (default: CPUs)")
+    parser.add_argument(
+        "--shards", type=int, default=None, help="stamp slides on this many processes (default: 1)"
+    )
+    parser.add_argument(
+        "--layout",
+        choices=list(PHOTO_LAYOUTS),
+        default=DEFAULT_PHOTO_LAYOUT,
+        help=f"photos per slide (default: {DEFAULT_PHOTO_LAYOUT})",
+    )
+    parser.add_argument(
+        "--corpus-dir",
+        type=Path,
+        default=DEFAULT_CORPUS_DIR,
+        help=f"where corpora are kept (default: {DEFAULT_CORPUS_DIR.name})",
+    )
+    parser.add_argument("-o", "--output", type=Path, help="write results JSON here")
+    parser.add_argument("--baseline", type=Path, help="earlier results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    results = run_suite(
+        args.counts,
+        args.size,
+        args.png_ratio,
+        args.preset,
+        args.workers,
+        args.corpus_dir,
+        args.shards,
+        args.layout,
+    )
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(results, indent=2))
+    if args.baseline:
+        compare(json.loads(args.baseline.read_text()), results)
+    return 0
+
+
+def cmd_verify(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog="pop_bench.py verify",
+        description="Check that pooled, sharded and memory-budgeted builds write the same "
+        "deck as a plain single-process build.",
+    )
+    parser.add_argument("--count", type=int, default=30, help="photos in the corpus (default: 30)")
+    parser.add_argument(
+        "--size", type=_size, default=(800, 600), help="photo size, WxH (default: 800x600)"
+    )
+    parser.add_argument("--preset", choices=list(IMAGE_PRESETS), default=DEFAULT_IMAGE_PRESET)
+    parser.add_argument(
+        "--layout",
+        choices=list(PHOTO_LAYOUTS),
+        action="append",
+        help="layout to check (repeatable; default: all)",
+    )
+    parser.add_argument("-j", "--workers", type=int, default=None, help="photo workers (default: CPUs)")
+    parser.add_argument(
+        "--corpus-dir",
+        type=Path,
+        default=DEFAULT_CORPUS_DIR,
+        help=f"where corpora are kept (default: {DEFAULT_CORPUS_DIR.name})",
+    )
+    args = parser.parse_args(argv)
+
+    corpus = corpus_path(args.corpus_dir, args.count, args.size, 0.1)
+    make_corpus(corpus, args.count, args.size, 0.1)
+    results = verify_builds(corpus, args.preset, args.layout or list(PHOTO_LAYOUTS), args.workers)
+
+    failed = False
+    for layout, modes in results.items():
+        for mode, parts in modes.items():
+            failed = failed or bool(parts)
+            outcome = f"{len(parts)} parts differ: {', '.join(parts[:5])}" if parts else "identical"
+            print(f"{layout:>7}  {mode:<9} {outcome}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
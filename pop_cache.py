@@ -0,0 +1,292 @@
+from pathlib import Path
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Tuple
+
+logger = logging.getLogger(__name__)
+
+# Environment variables the default cache is configured from. Worker processes
+# inherit them, so every process of a build shares the same cache.
+CACHE_DIR_ENV = "POP_IMAGE_CACHE_DIR"
+CACHE_MB_ENV = "POP_IMAGE_CACHE_MB"
+CACHE_DAYS_ENV = "POP_IMAGE_CACHE_DAYS"
+
+DEFAULT_CACHE_MB = 2048
+DEFAULT_CACHE_DAYS = 30
+
+# Bump when prepared photos change for the same source and settings, so old
+# entries stop matching (they age out like any other)
+CACHE_FORMAT = 1
+
+# A hit refreshes an entry's last use at most this often, to keep reads cheap
+TOUCH_SECONDS = 60
+
+# Seconds a process waits for another one holding the index's write lock
+LOCK_TIMEOUT = 30
+
+# Each ImageCache evicts after this many stores or bytes stored, whichever comes first,
+# rather than scanning the index under the write lock on every store
+EVICT_EVERY_STORES = 64
+EVICT_EVERY_BYTES = 64 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    file TEXT,
+    bytes INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+CREATE TABLE IF NOT EXISTS probes (
+    digest TEXT PRIMARY KEY,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    format TEXT NOT NULL,
+    orientation INTEGER NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS probes_used ON probes (used);
+"""
+
+
+class ImageCache:
+    """
+    Prepared photos on disk, addressed by the SHA-256 of the source bytes plus
+    the settings they were prepared with, so re-uploads of the same photo (under
+    any filename) skip decoding and re-encoding. Header probes (size, format,
+    EXIF orientation) are kept per source as well.
+
+    Media files live under `root`, indexed by an SQLite database that survives
+    restarts. Entries unused for `max_age` seconds are dropped, then the least
+    recently used ones until the media fits in `max_bytes`; this runs every
+    EVICT_EVERY_STORES stores or EVICT_EVERY_BYTES stored, so the media may
+    overshoot `max_bytes` by about that much in between. Any number of
+    threads and processes may share one `root`: index writes are transactions,
+    and media files are written under fresh names and renamed into place, so
+    readers never see a partial file. A photo evicted while being read is a miss.
+
+    The cache never fails a build: if the index or a file can't be used, the
+    lookup is a miss and the problem is logged.
+    """
+
+    def __init__(
+        self,
+        root,
+        max_bytes: int = DEFAULT_CACHE_MB * 1024 * 1024,
+        max_age: float = DEFAULT_CACHE_DAYS * 86400,
+    ):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._local = threading.local()
+        self._evict_lock = threading.Lock()
+        self._stores = 0
+        self._stored_bytes = 0
+
+    def lookup(self, digest: str, params: str) -> Tuple[bytes | None, Tuple[int, int]] | None:
+        """
+        The photo prepared from source `digest` with `params`, as (blob, size),
+        or None if it isn't cached. A None blob means the source is embedded as it is.
+        """
+        key = _entry_key(digest, params)
+        try:
+            row = self._db().execute(
+                "SELECT file, width, height, used FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            file, width, height, used = row
+            blob = (self.root / file).read_bytes() if file else None
+            now = time.time()
+            if now - used > TOUCH_SECONDS:
+                with self._write() as db:
+                    db.execute("UPDATE entries SET used = ? WHERE key = ?", (now, key))
+        except FileNotFoundError:
+            return None  # evicted by another process in the meantime
+        except (sqlite3.Error, OSError):
+            logger.warning("Image cache lookup failed in %s", self.root, exc_info=True)
+            return None
+        return blob, (width, height)
+
+    def store(self, digest: str, params: str, blob: bytes | None, size: Tuple[int, int]) -> None:
+        """Cache a prepared photo; pass `blob=None` when the source is embedded as it is."""
+        key = _entry_key(digest, params)
+        file = None
+        try:
+            if blob is not None:
+                file = self._write_media(key, blob)
+            with self._write() as db:
+                old = db.execute("SELECT file FROM entries WHERE key = ?", (key,)).fetchone()
+                db.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, file, len(blob) if blob is not None else 0, *size, time.time()),
+                )
+        except (sqlite3.Error, OSError):
+            logger.warning("Could not cache a prepared photo in %s", self.root, exc_info=True)
+            # Nothing was committed, so nothing points at the new file
+            if file:
+                (self.root / file).unlink(missing_ok=True)
+            return
+
+        try:
+            if old and old[0]:
+                (self.root / old[0]).unlink(missing_ok=True)
+            if self._due_for_eviction(len(blob) if blob is not None else 0):
+                self.evict()
+        except (sqlite3.Error, OSError):
+            logger.warning("Image cache eviction failed in %s", self.root, exc_info=True)
+
+    def probe(self, digest: str) -> Tuple[int, int, str, int] | None:
+        """Cached (width, height, format, orientation) of source `digest`, or None."""
+        try:
+            row = self._db().execute(
+                "SELECT width, height, format, orientation, used FROM probes WHERE digest = ?",
+                (digest,),
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[4] > TOUCH_SECONDS:
+                with self._write() as db:
+                    db.execute("UPDATE probes SET used = ? WHERE digest = ?", (now, digest))
+        except sqlite3.Error:
+            logger.warning("Image cache lookup failed in %s", self.root, exc_info=True)
+            return None
+        return row[:4]
+
+    def store_probe(
+        self, digest: str, width: int, height: int, format: str, orientation: int
+    ) -> None:
+        try:
+            with self._write() as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?, ?)",
+                    (digest, width, height, format, orientation, time.time()),
+                )
+        except sqlite3.Error:
+            logger.warning("Could not cache a photo probe in %s", self.root, exc_info=True)
+
+    def evict(self) -> int:
+        """
+        Drop entries unused for `max_age`, then the least recently used ones
+        until the media fits in `max_bytes`. Returns the bytes freed.
+        """
+        cutoff = time.time() - self.max_age
+        with self._write() as db:
+            db.execute("DELETE FROM probes WHERE used < ?", (cutoff,))
+            doomed = db.execute(
+                "SELECT key, file, bytes FROM entries WHERE used < ?", (cutoff,)
+            ).fetchall()
+            (total,) = db.execute(
+                "SELECT COALESCE(SUM(bytes), 0) FROM entries WHERE used >= ?", (cutoff,)
+            ).fetchone()
+            if total > self.max_bytes:
+                for row in db.execute(
+                    "SELECT key, file, bytes FROM entries WHERE used >= ? ORDER BY used", (cutoff,)
+                ):
+                    if total <= self.max_bytes:
+                        break
+                    doomed.append(row)
+                    total -= row[2]
+            db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _, _ in doomed])
+
+        # Files are only removed once no entry points at them any more
+        for _, file, _ in doomed:
+            if file:
+                (self.root / file).unlink(missing_ok=True)
+        return sum(size for _, _, size in doomed)
+
+    def _due_for_eviction(self, size: int) -> bool:
+        with self._evict_lock:
+            self._stores += 1
+            self._stored_bytes += size
+            if self._stores < EVICT_EVERY_STORES and self._stored_bytes < EVICT_EVERY_BYTES:
+                return False
+            self._stores = self._stored_bytes = 0
+            return True
+
+    def stats(self) -> dict:
+        """Number of cached photos and probes, and the bytes of media on disk."""
+        db = self._db()
+        entries, size = db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM entries"
+        ).fetchone()
+        (probes,) = db.execute("SELECT COUNT(*) FROM probes").fetchone()
+        return {"entries": entries, "bytes": size, "probes": probes}
+
+    def _db(self) -> sqlite3.Connection:
+        # One connection per thread and process; connections never cross a fork
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            self.root.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(
+                self.root / "index.sqlite3", timeout=LOCK_TIMEOUT, isolation_level=None
+            )
+            db.execute("PRAGMA journal_mode = WAL")
+            db.execute("PRAGMA synchronous = NORMAL")
+            db.executescript(_SCHEMA)
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    @contextmanager
+    def _write(self):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _write_media(self, key: str, blob: bytes) -> str:
+        # A fresh name per write: evicting an old copy can never remove a newer one
+        file = f"{key[:2]}/{key}-{uuid.uuid4().hex[:8]}{_suffix(blob)}"
+        path = self.root / file
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_bytes(blob)
+        os.replace(tmp, path)
+        return file
+
+
+def _entry_key(digest: str, params: str) -> str:
+    return f"{digest}-{params}-v{CACHE_FORMAT}"
+
+
+def _suffix(blob: bytes) -> str:
+    return ".png" if blob.startswith(b"\x89PNG") else ".jpg"
+
+
+_default_lock = threading.Lock()
+_default: tuple = (None, None)
+
+
+def default_image_cache() -> ImageCache | None:
+    """
+    The cache configured by POP_IMAGE_CACHE_DIR (plus POP_IMAGE_CACHE_MB and
+    POP_IMAGE_CACHE_DAYS), or None when it is unset.
+    """
+    global _default
+    settings = tuple(os.environ.get(name) for name in (CACHE_DIR_ENV, CACHE_MB_ENV, CACHE_DAYS_ENV))
+    with _default_lock:
+        if _default[0] != settings:
+            root, mb, days = settings
+            cache = None
+            if root:
+                cache = ImageCache(
+                    root,
+                    int(mb or DEFAULT_CACHE_MB) * 1024 * 1024,
+                    float(days or DEFAULT_CACHE_DAYS) * 86400,
+                )
+            _default = (settings, cache)
+        return _default[1]
+
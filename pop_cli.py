@@ -0,0 +1,312 @@
+from pathlib import Path
+import argparse
+import glob
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from typing import List
+
+from pop_batch import REPORT_FORMATS, deck_names, generate_batch_dir, group_by_report
+from pop_cache import CACHE_DIR_ENV
+from pop_images import DEFAULT_IMAGE_PRESET, IMAGE_PRESETS, source_digest
+from pop_utils_web import (
+    DEFAULT_PHOTO_LAYOUT,
+    PHOTO_LAYOUTS,
+    ReportBuilder,
+    parse_photo_name,
+    save_presentation,
+)
+
+logger = logging.getLogger("pop_cli")
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
+
+# Decks whose ReportBuilder (and with it the whole deck) a watcher keeps in
+# memory between rebuilds; the rest are rebuilt from scratch when they change
+KEPT_BUILDERS = 4
+
+
+def expand_inputs(inputs: List[str]) -> List[Path]:
+    """Turn CLI arguments (files, directories or glob patterns) into paths."""
+    paths: List[Path] = []
+    for arg in inputs:
+        if glob.has_magic(arg):
+            matches = sorted(glob.glob(arg, recursive=True))
+            if not matches:
+                logger.warning("No files match %s", arg)
+            paths.extend(Path(m) for m in matches)
+        elif Path(arg).exists():
+            paths.append(Path(arg))
+        else:
+            logger.warning("No such file or directory: %s", arg)
+    return paths
+
+
+def _log_progress(event: dict) -> None:
+    logger.info("[%d/%d] %s: %s", event["done"], event["total"], event["status"], event["deck"])
+
+
+def cmd_build(args) -> int:
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        logger.error("Nothing to build.")
+        return 2
+
+    results = generate_batch_dir(
+        paths,
+        args.output,
+        image_preset=args.quality,
+        jobs=args.jobs,
+        progress=_log_progress,
+        report_format=args.format,
+        photo_layout=args.layout,
+    )
+    failed = [r for r in results if r["error"]]
+    for r in failed:
+        logger.error("%s failed: %s", r["name"], r["error"])
+    logger.info("Built %d of %d reports into %s", len(results) - len(failed), len(results), args.output)
+    return 1 if failed else 0
+
+
+class DropFolderWatcher:
+    """
+    Polls a drop folder and rebuilds only the decks whose photos changed.
+
+    A rebuild starts once the folder has been quiet for `debounce` seconds, so
+    copying in hundreds of photos triggers one build rather than hundreds. The
+    KEPT_BUILDERS most recently built decks keep their ReportBuilder between
+    rebuilds, so only new or changed photos are prepared again; other decks
+    start over (cheaply with POP_IMAGE_CACHE_DIR set, see pop_cache). Photos
+    are hashed once per (size, mtime) seen by the scan, not on every rebuild.
+    """
+
+    def __init__(
+        self,
+        drop_dir,
+        out_dir,
+        image_preset,
+        workers,
+        debounce: float,
+        interval: float,
+        photo_layout=DEFAULT_PHOTO_LAYOUT,
+    ):
+        self.drop_dir = Path(drop_dir)
+        self.out_dir = Path(out_dir)
+        self.image_preset = image_preset
+        self.photo_layout = photo_layout
+        self.workers = workers
+        self.debounce = debounce
+        self.interval = interval
+        self._snapshot: dict = {}
+        self._builders: OrderedDict = OrderedDict()
+        self._names: dict = {}
+        # path -> ((size, mtime_ns), SHA-1) of photos already hashed
+        self._digests: dict = {}
+
+    def scan(self) -> dict:
+        """Return {path: (size, mtime_ns)} for every photo in the drop folder."""
+        snapshot = {}
+        with os.scandir(self.drop_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and Path(entry.name).suffix.lower() in IMAGE_SUFFIXES:
+                    stat = entry.stat()
+                    snapshot[Path(entry.path)] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def run(self) -> None:
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        logger.info("Watching %s, writing reports to %s", self.drop_dir, self.out_dir)
+
+        changed: set = set()
+        last_change = None
+        while True:
+            current = self.scan()
+            diff = {
+                path
+                for path in current.keys() | self._snapshot.keys()
+                if current.get(path) != self._snapshot.get(path)
+            }
+            self._snapshot = current
+            if diff:
+                changed |= diff
+                last_change = time.monotonic()
+            elif changed and time.monotonic() - last_change >= self.debounce:
+                self.rebuild(changed)
+                changed = set()
+            time.sleep(self.interval)
+
+    def rebuild(self, changed: set) -> None:
+        """Rebuild the decks that any of the `changed` photo paths belong to."""
+        affected = set()
+        for path in changed:
+            info = parse_photo_name(path)
+            if info.valid:
+                affected.add(info.report_key)
+
+        # group_by_report refuses an empty list; with no photos left every deck goes
+        groups = group_by_report(list(self._snapshot)) if self._snapshot else {}
+        names = deck_names(groups)
+
+        # Decks whose name changed because another campaign now shares it
+        for key, name in names.items():
+            old = self._names.get(key)
+            if key not in affected and old and old != name and (self.out_dir / old).exists():
+                os.replace(self.out_dir / old, self.out_dir / name)
+                self._names[key] = name
+
+        for key in sorted(affected):
+            if key not in groups:
+                self._remove(key)
+                continue
+            try:
+                self._build(key, groups[key], names[key])
+            except Exception:
+                # Usually a photo still being copied in; the next change retries
+                logger.exception("Could not build %s", names[key])
+
+    def _build(self, key, sources: list, name: str) -> None:
+        builder = self._builders.pop(key, None)
+        if builder is None:
+            builder = ReportBuilder(self.image_preset, self.workers, photo_layout=self.photo_layout)
+        self._builders[key] = builder
+        while len(self._builders) > KEPT_BUILDERS:
+            self._builders.popitem(last=False)
+
+        started = time.monotonic()
+        prs, _ = builder.build(sources, digests=self._digests_for(sources))
+        fd, tmp = tempfile.mkstemp(prefix=".pop_", suffix=".pptx", dir=self.out_dir)
+        os.close(fd)
+        try:
+            save_presentation(prs, tmp)
+            os.chmod(tmp, 0o644)  # mkstemp creates files readable by the owner only
+            os.replace(tmp, self.out_dir / name)
+        finally:
+            Path(tmp).unlink(missing_ok=True)
+
+        old = self._names.get(key)
+        if old and old != name:
+            (self.out_dir / old).unlink(missing_ok=True)
+        self._names[key] = name
+        logger.info(
+            "Rebuilt %s (%d photos) in %.1fs", name, len(sources), time.monotonic() - started
+        )
+
+    def _digests_for(self, sources: list) -> dict:
+        """SHA-1 per source, hashing only photos whose scanned size or mtime changed."""
+        for path in [p for p in self._digests if p not in self._snapshot]:
+            del self._digests[path]
+        digests = {}
+        for path in sources:
+            stat = self._snapshot.get(path)
+            known = self._digests.get(path)
+            if known is None or known[0] != stat:
+                known = self._digests[path] = (stat, source_digest(path))
+            digests[path] = known[1]
+        return digests
+
+    def _remove(self, key) -> None:
+        self._builders.pop(key, None)
+        name = self._names.pop(key, None)
+        if name:
+            (self.out_dir / name).unlink(missing_ok=True)
+            logger.info("Removed %s: no photos left", name)
+
+
+def cmd_watch(args) -> int:
+    watcher = DropFolderWatcher(
+        args.drop_dir,
+        args.output,
+        image_preset=args.quality,
+        workers=args.jobs,
+        debounce=args.debounce,
+        interval=args.interval,
+        photo_layout=args.layout,
+    )
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="pop_cli.py",
+        description="Build PoP reports without the Streamlit UI.",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("-o", "--output", required=True, help="directory to write reports to")
+    common.add_argument(
+        "-j", "--jobs", type=int, default=None, help="parallel worker processes (default: CPUs)"
+    )
+    common.add_argument(
+        "-q",
+        "--quality",
+        choices=list(IMAGE_PRESETS),
+        default=DEFAULT_IMAGE_PRESET,
+        help=f"photo quality preset (default: {DEFAULT_IMAGE_PRESET})",
+    )
+    common.add_argument(
+        "-l",
+        "--layout",
+        choices=list(PHOTO_LAYOUTS),
+        default=DEFAULT_PHOTO_LAYOUT,
+        help=f"photos per slide (default: {DEFAULT_PHOTO_LAYOUT})",
+    )
+    common.add_argument(
+        "--cache-dir",
+        default=None,
+        help=f"keep prepared photos here across runs (default: ${CACHE_DIR_ENV}, if set)",
+    )
+
+    build = sub.add_parser(
+        "build",
+        parents=[common],
+        help="build one report per client/campaign/month",
+    )
+    build.add_argument("inputs", nargs="+", help="photo files, directories or glob patterns")
+    build.add_argument(
+        "-f",
+        "--format",
+        choices=REPORT_FORMATS,
+        default="pptx",
+        help="report format (default: pptx)",
+    )
+    build.set_defaults(func=cmd_build)
+
+    watch = sub.add_parser(
+        "watch",
+        parents=[common],
+        help="watch a drop folder and rebuild affected reports",
+    )
+    watch.add_argument("drop_dir", help="folder photos are dropped into")
+    watch.add_argument(
+        "--debounce",
+        type=float,
+        default=10.0,
+        help="seconds without changes before rebuilding (default: 10)",
+    )
+    watch.add_argument(
+        "--interval", type=float, default=2.0, help="seconds between folder scans (default: 2)"
+    )
+    watch.set_defaults(func=cmd_watch)
+
+    return parser
+
+
+def main(argv: List[str] | None = None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    args = build_parser().parse_args(argv)
+    if args.cache_dir:
+        # Through the environment, so worker processes use the same cache
+        os.environ[CACHE_DIR_ENV] = args.cache_dir
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,656 @@
+from pathlib import Path
+from PIL import Image, ImageOps
+import hashlib
+import io
+import math
+import multiprocessing
+import os
+import struct
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import BinaryIO, Iterable, Iterator, Tuple
+
+from pop_cache import default_image_cache
+
+# Quality presets for embedded PoP photos.
+# "dpi" is the pixel density at the size the photo is shown on the slide,
+# "quality" the JPEG quality used when re-encoding. None means embed as-is.
+IMAGE_PRESETS = {
+    "original": None,
+    "print": {"dpi": 300, "quality": 90},
+    "standard": {"dpi": 200, "quality": 85},
+    "email": {"dpi": 120, "quality": 75},
+}
+DEFAULT_IMAGE_PRESET = "standard"
+
+# EXIF tag holding the camera orientation (1 = upright, 5-8 = rotated by 90 degrees)
+ORIENTATION_TAG = 0x0112
+
+# Longest edge of preview thumbnails, in pixels
+THUMBNAIL_PX = 240
+
+# JPEG start-of-frame markers, which carry the image size
+_JPEG_SOF_MARKERS = frozenset((0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF))
+
+# Worker processes start from a fork server, not a fork of this process: forking a
+# multithreaded process (Streamlit, pop_server) can copy a lock another thread holds,
+# such as _probe_lock or the image cache's, and deadlock the child. The server
+# imports these modules once, so each worker starts without re-importing them.
+_WORKER_START_METHOD = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+_WORKER_MODULES = ["pop_images", "pop_utils_web", "pop_batch"]
+
+# Header probes remembered by content hash
+PROBE_CACHE_SIZE = 65536
+_probe_cache: OrderedDict = OrderedDict()
+_probe_lock = threading.Lock()
+
+
+class NamedBuffer(io.BytesIO):
+    """
+    An in-memory image with a filename, shaped like Streamlit's UploadedFile.
+    `data` may be bytes, a bytearray or a memoryview; bytes are not copied.
+    """
+
+    def __init__(self, name: str, data=b""):
+        super().__init__(data)
+        self.name = name
+
+
+class PreparedImage:
+    """
+    An image ready to embed: encoded bytes, their SHA-1 (the same digest
+    python-pptx keys image parts on) and the pixel size to lay it out with.
+    """
+
+    __slots__ = ("filename", "blob", "size", "sha1")
+
+    def __init__(self, filename: str, blob: bytes, size: Tuple[int, int]):
+        self.filename = filename
+        self.blob = blob
+        self.size = size
+        self.sha1 = hashlib.sha1(blob).hexdigest()
+
+
+class ImageInfo:
+    """Header facts about a photo: stored pixel size, format and EXIF orientation."""
+
+    __slots__ = ("width", "height", "format", "orientation")
+
+    def __init__(self, width: int, height: int, format: str, orientation: int = 1):
+        self.width = width
+        self.height = height
+        self.format = format
+        self.orientation = orientation
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return (self.width, self.height)
+
+    @property
+    def upright_size(self) -> Tuple[int, int]:
+        """Size once the EXIF orientation is applied (5-8 swap width and height)."""
+        return self.size if self.orientation < 5 else (self.height, self.width)
+
+
+def process_pool(workers: int) -> ProcessPoolExecutor:
+    """A process pool that is safe to start from a multithreaded process."""
+    context = multiprocessing.get_context(_WORKER_START_METHOD)
+    if _WORKER_START_METHOD == "forkserver":
+        context.set_forkserver_preload(_WORKER_MODULES)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+
+def resolve_preset(preset) -> dict | None:
+    """Accept a preset name or a {"dpi", "quality"} dict; return the settings dict."""
+    if preset is None or isinstance(preset, dict):
+        return preset
+    try:
+        return IMAGE_PRESETS[preset]
+    except KeyError:
+        raise ValueError(
+            f"Unknown image preset {preset!r}. Choose one of: {', '.join(IMAGE_PRESETS)}."
+        ) from None
+
+
+def read_source(source) -> Tuple[str, bytes]:
+    """
+    Return (filename, bytes) for a path or an in-memory file.
+
+    In-memory files are anything with `.name` and `getvalue()`, such as
+    NamedBuffer or Streamlit's UploadedFile; their bytes are used in place.
+    """
+    if hasattr(source, "getvalue"):
+        return Path(source.name).name, source.getvalue()
+    path = Path(source)
+    return path.name, path.read_bytes()
+
+
+def source_digest(source) -> str:
+    """SHA-1 of a source's bytes; files are hashed in chunks rather than loaded whole."""
+    if hasattr(source, "getvalue"):
+        return hashlib.sha1(source.getvalue()).hexdigest()
+    digest = hashlib.sha1()
+    with open(source, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def prepare_image(
+    source,
+    box_cm: Tuple[float, float],
+    preset=DEFAULT_IMAGE_PRESET,
+    digest: str | None = None,
+    info: ImageInfo | None = None,
+) -> PreparedImage:
+    """
+    Read a photo once and get it ready for a box of `box_cm` (width, height).
+    `source` is a path or an in-memory file (see `read_source`).
+
+    With a preset, the photo is EXIF-rotated, downscaled so it is no larger than
+    the box at the preset's DPI, and re-encoded as optimised JPEG (or PNG when
+    it has transparency). Photos that are already small enough and upright are
+    embedded untouched. The "original" preset always embeds the source bytes.
+
+    The header probe goes through `probe_image` with `digest` (see
+    `source_digest`), so a photo already probed for the upload table isn't
+    probed again; `info` hands over a probe made in another process.
+    When an image cache is configured (see pop_cache), photos already prepared
+    with the same settings are read back from it instead.
+    """
+    name, data = read_source(source)
+    settings = resolve_preset(preset)
+    cache = default_image_cache() if settings is not None else None
+    if cache is None:
+        info = info or probe_image(NamedBuffer(name, data), digest)
+        return _prepare(name, data, info, box_cm, settings)
+
+    key = hashlib.sha256(data).hexdigest()
+    target = _target_px(box_cm, settings)
+    params = f"{target[0]}x{target[1]}q{settings['quality']}"
+    hit = cache.lookup(key, params)
+    if hit is not None:
+        blob, size = hit
+        return PreparedImage(name, data if blob is None else blob, size)
+
+    if info is None:
+        probed = cache.probe(key)
+        info = ImageInfo(*probed) if probed else probe_image(NamedBuffer(name, data), digest)
+        if info is not None and not probed:
+            cache.store_probe(key, info.width, info.height, info.format, info.orientation)
+    image = _prepare(name, data, info, box_cm, settings)
+    cache.store(key, params, None if image.blob is data else image.blob, image.size)
+    return image
+
+
+def _prepare(name: str, data: bytes, info: ImageInfo | None, box_cm, settings: dict | None):
+    # Photos embedded as they are need no decoding at all, only their header
+    if info is not None:
+        if settings is None:
+            return PreparedImage(name, data, info.size)
+        target = _target_px(box_cm, settings)
+        if info.orientation == 1 and info.width <= target[0] and info.height <= target[1]:
+            return PreparedImage(name, data, info.size)
+
+    with Image.open(io.BytesIO(data)) as img:
+        if settings is None:
+            return PreparedImage(name, data, img.size)
+
+        target = _target_px(box_cm, settings)
+        orientation = img.getexif().get(ORIENTATION_TAG, 1)
+        fits = img.width <= target[0] and img.height <= target[1]
+        if fits and orientation == 1 and img.format in ("JPEG", "PNG"):
+            return PreparedImage(name, data, img.size)
+
+        # Let the JPEG decoder do most of the downscaling for us
+        if img.format == "JPEG":
+            img.draft("RGB", _stored_size(img.size, target, orientation))
+
+        out = ImageOps.exif_transpose(img)
+        out.thumbnail(target, Image.Resampling.LANCZOS)
+        return PreparedImage(name, _encode(out, settings["quality"]), out.size)
+
+
+def prepare_images(
+    sources: Iterable,
+    box_cm: Tuple[float, float],
+    preset=DEFAULT_IMAGE_PRESET,
+    workers: int | None = None,
+    digests: Iterable | None = None,
+) -> Iterator[PreparedImage]:
+    """
+    Prepare many photos across a process pool, yielding them in input order.
+    In-memory sources are handed to the workers as plain NamedBuffers, along
+    with any probe this process already made of them (`digests` lists each
+    source's `source_digest`, or None where it isn't known).
+
+    At most `2 * workers` photos are queued or finished-but-not-yet-consumed at
+    any time, so a long batch never has every decoded photo in memory at once.
+    `workers` defaults to the CPU count; 1 (or the "original" preset, which does
+    no pixel work) prepares everything in this process.
+    """
+    sources = list(sources)
+    digests = list(digests) if digests is not None else [None] * len(sources)
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(sources) <= 1 or resolve_preset(preset) is None:
+        for source, digest in zip(sources, digests):
+            yield prepare_image(source, box_cm, preset, digest)
+        return
+
+    todo = (
+        (portable_source(source), box_cm, preset, digest, _cached_probe(digest))
+        for source, digest in zip(sources, digests)
+    )
+    with process_pool(min(workers, len(sources))) as pool:
+        pending = deque(pool.submit(prepare_image, *args) for args in islice(todo, 2 * workers))
+        while pending:
+            image = pending.popleft().result()
+            args = next(todo, None)
+            if args is not None:
+                pending.append(pool.submit(prepare_image, *args))
+            yield image
+
+
+def _target_px(box_cm: Tuple[float, float], settings: dict) -> Tuple[int, int]:
+    return (
+        max(1, round(box_cm[0] / 2.54 * settings["dpi"])),
+        max(1, round(box_cm[1] / 2.54 * settings["dpi"])),
+    )
+
+
+def probe_image(source, digest: str | None = None) -> ImageInfo | None:
+    """
+    Read a photo's size, format and EXIF orientation from its JPEG/PNG headers
+    without decoding any pixels; None if it isn't a readable JPEG or PNG.
+
+    Files are read only as far as the headers go and closed straight away.
+    With `digest` (see `source_digest`) the result is cached by content.
+    """
+    if digest is not None:
+        with _probe_lock:
+            if digest in _probe_cache:
+                _probe_cache.move_to_end(digest)
+                return _probe_cache[digest]
+
+    if hasattr(source, "getvalue"):
+        info = _probe_bytes(source.getvalue())
+    else:
+        try:
+            with open(source, "rb") as f:
+                info = _probe_file(f)
+        except OSError:
+            info = None
+
+    if digest is not None:
+        with _probe_lock:
+            _probe_cache[digest] = info
+            if len(_probe_cache) > PROBE_CACHE_SIZE:
+                _probe_cache.popitem(last=False)
+    return info
+
+
+def _cached_probe(digest: str | None) -> ImageInfo | None:
+    """The probe `probe_image` remembers for `digest`, without reading anything."""
+    if digest is None:
+        return None
+    with _probe_lock:
+        return _probe_cache.get(digest)
+
+
+def probe_images(sources, digests=None, workers: int = 8) -> list:
+    """`probe_image` over many sources on a thread pool; results in input order."""
+    sources = list(sources)
+    digests = list(digests) if digests is not None else [None] * len(sources)
+    if len(sources) <= 1:
+        return [probe_image(s, d) for s, d in zip(sources, digests)]
+    with ThreadPoolExecutor(max_workers=min(workers, len(sources))) as pool:
+        return list(pool.map(probe_image, sources, digests))
+
+
+def _probe_bytes(data) -> ImageInfo | None:
+    return _probe_file(io.BytesIO(data))
+
+
+def _probe_file(f: BinaryIO) -> ImageInfo | None:
+    try:
+        head = f.read(8)
+        if head[:2] == b"\xff\xd8":
+            f.seek(2)
+            return _probe_jpeg(f)
+        if head == b"\x89PNG\r\n\x1a\n":
+            return _probe_png(f)
+    except (struct.error, ValueError):
+        pass
+    return None
+
+
+def _probe_jpeg(f: BinaryIO) -> ImageInfo | None:
+    orientation = 1
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b"\xff":
+            continue
+        marker = f.read(1)
+        while marker == b"\xff":  # fill bytes
+            marker = f.read(1)
+        if not marker:
+            return None
+        code = marker[0]
+        if code == 0xD8 or code == 0x01 or 0xD0 <= code <= 0xD7:
+            continue  # markers without a length
+        if code == 0xDA:
+            return None  # scan data reached without a frame header
+
+        (length,) = struct.unpack(">H", f.read(2))
+        if code in _JPEG_SOF_MARKERS:
+            _, height, width = struct.unpack(">BHH", f.read(5))
+            return ImageInfo(width, height, "JPEG", orientation)
+        if code == 0xE1:
+            segment = f.read(length - 2)
+            if segment[:6] == b"Exif\x00\x00":
+                orientation = _exif_orientation(segment[6:])
+        else:
+            f.seek(length - 2, io.SEEK_CUR)
+
+
+def _probe_png(f: BinaryIO) -> ImageInfo | None:
+    length, kind = struct.unpack(">I4s", f.read(8))
+    if kind != b"IHDR":
+        return None
+    width, height = struct.unpack(">II", f.read(8))
+    f.seek(length - 8 + 4, io.SEEK_CUR)  # rest of IHDR and its CRC
+
+    # An eXIf chunk, if any, comes before the image data
+    orientation = 1
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        length, kind = struct.unpack(">I4s", header)
+        if kind == b"IDAT" or kind == b"IEND":
+            break
+        if kind == b"eXIf":
+            orientation = _exif_orientation(f.read(length))
+            break
+        f.seek(length + 4, io.SEEK_CUR)
+    return ImageInfo(width, height, "PNG", orientation)
+
+
+def _exif_orientation(tiff: bytes) -> int:
+    """
+    Orientation tag from the first IFD of a TIFF-structured EXIF block; 1 when
+    it is missing or the block is malformed (PIL still opens such photos).
+    """
+    if tiff[:2] == b"II":
+        order = "<"
+    elif tiff[:2] == b"MM":
+        order = ">"
+    else:
+        return 1
+    try:
+        (ifd,) = struct.unpack_from(order + "I", tiff, 4)
+        (count,) = struct.unpack_from(order + "H", tiff, ifd)
+        for n in range(count):
+            tag, _, _, value = struct.unpack_from(order + "HHIH", tiff, ifd + 2 + 12 * n)
+            if tag == ORIENTATION_TAG:
+                return value if 1 <= value <= 8 else 1
+    except struct.error:
+        pass
+    return 1
+
+
+def make_thumbnail(source, max_px: int = THUMBNAIL_PX) -> bytes:
+    """
+    Small upright JPEG preview of a photo. JPEGs are decoded at reduced size
+    (PIL draft mode), so a full-size photo is never decoded just for a preview.
+    """
+    _, data = read_source(source)
+    with Image.open(io.BytesIO(data)) as img:
+        if img.format == "JPEG":
+            img.draft("RGB", (max_px, max_px))
+        thumb = ImageOps.exif_transpose(img)
+        thumb.thumbnail((max_px, max_px), Image.Resampling.LANCZOS)
+
+    bio = io.BytesIO()
+    thumb.convert("RGB").save(bio, format="JPEG", quality=75)
+    return bio.getvalue()
+
+
+class ThumbnailCache:
+    """
+    Thumbnails keyed by content hash, least recently used dropped first once
+    they add up to more than `max_bytes`. Safe to share between sessions.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, max_px: int = THUMBNAIL_PX):
+        self.max_bytes = max_bytes
+        self.max_px = max_px
+        self._thumbs: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, source, digest: str | None = None) -> bytes | None:
+        """
+        Thumbnail for `source`, made on first use; None if it can't be read as
+        an image. Pass `digest` (see `source_digest`) if the caller already has it.
+        """
+        digest = digest or source_digest(source)
+        with self._lock:
+            thumb = self._thumbs.get(digest)
+            if thumb is not None:
+                self._thumbs.move_to_end(digest)
+                return thumb
+
+        try:
+            thumb = make_thumbnail(source, self.max_px)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            return None
+
+        with self._lock:
+            if digest not in self._thumbs:
+                self._thumbs[digest] = thumb
+                self._bytes += len(thumb)
+            while self._bytes > self.max_bytes and len(self._thumbs) > 1:
+                _, dropped = self._thumbs.popitem(last=False)
+                self._bytes -= len(dropped)
+        return thumb
+
+
+class Preprocessor:
+    """
+    Hashes and prepares photos on a background thread as soon as they are
+    handed over, so a build started later finds most of them ready (see the
+    `prepared` argument of ReportBuilder.build). The thread exits once the
+    queue is empty, so a Preprocessor nobody refers to any more is collected
+    along with its photos even if it was never closed.
+
+    Photos are identified by caller-chosen ids. `submit` takes the full
+    current list each time: new ids are queued, ids no longer listed are
+    forgotten along with their prepared image. Each id moves through
+    "queued", "preparing" and then "ready" or "failed".
+    """
+
+    def __init__(
+        self, box_cm: Tuple[float, float], preset=DEFAULT_IMAGE_PRESET, workers: int | None = None
+    ):
+        resolve_preset(preset)
+        self.box_cm = box_cm
+        self.preset = preset
+        self.workers = workers or os.cpu_count() or 1
+        self._lock = threading.Lock()
+        self._queue: deque = deque()
+        self._status: dict = {}
+        self._keys: dict = {}
+        self._prepared: dict = {}
+        self._closed = False
+        # Runs only while there is work, so an abandoned Preprocessor can be collected
+        self._thread = None
+
+    def submit(self, items, digests: dict | None = None) -> None:
+        """
+        Queue each (id, source) in `items` not seen before; forget ids not in `items`.
+        `digests` maps ids to the `source_digest` of sources the caller has already hashed.
+        """
+        items = list(items)
+        digests = digests or {}
+        wanted = {item_id for item_id, _ in items}
+        with self._lock:
+            for item_id in [i for i in self._status if i not in wanted]:
+                del self._status[item_id]
+                key = self._keys.pop(item_id, None)
+                if key is not None and key not in self._keys.values():
+                    self._prepared.pop(key, None)
+            self._queue = deque(item for item in self._queue if item[0] in wanted)
+            for item_id, source in items:
+                if item_id not in self._status:
+                    self._status[item_id] = "queued"
+                    self._queue.append((item_id, source, digests.get(item_id)))
+            if self._queue and self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="pop-preprocess", daemon=True)
+                self._thread.start()
+
+    def status(self, item_id) -> str | None:
+        with self._lock:
+            return self._status.get(item_id)
+
+    def counts(self) -> dict:
+        """How many photos are in each status."""
+        with self._lock:
+            counts: dict = {}
+            for status in self._status.values():
+                counts[status] = counts.get(status, 0) + 1
+            return counts
+
+    def busy(self) -> bool:
+        with self._lock:
+            return any(s in ("queued", "preparing") for s in self._status.values())
+
+    def prepared(self) -> dict:
+        """Snapshot of the photos ready so far: {(filename, SHA-1): PreparedImage}."""
+        with self._lock:
+            return dict(self._prepared)
+
+    def close(self) -> None:
+        """Stop after the photos already being prepared; nothing further is queued."""
+        with self._lock:
+            self._closed = True
+            self._queue.clear()
+
+    def _next(self):
+        with self._lock:
+            if self._queue:
+                item_id, source, digest = self._queue.popleft()
+                self._status[item_id] = "preparing"
+                return item_id, source, digest
+        return None
+
+    def _run(self) -> None:
+        try:
+            while True:
+                if self.workers <= 1 or resolve_preset(self.preset) is None:
+                    # Nothing to gain from a pool: no pixel work, or no spare CPU
+                    for item in iter(self._next, None):
+                        self._prepare_here(*item)
+                else:
+                    self._prepare_on_pool()
+                # Exit once idle; `submit` starts a new thread for new work
+                with self._lock:
+                    if not self._queue or self._closed:
+                        self._thread = None
+                        return
+        except BaseException:
+            with self._lock:
+                self._thread = None
+            raise
+
+    def _prepare_here(self, item_id, source, digest) -> None:
+        try:
+            key = (Path(source.name).name, digest or source_digest(source))
+            with self._lock:
+                image = self._prepared.get(key)
+            image = image or prepare_image(source, self.box_cm, self.preset, key[1])
+        except Exception:
+            self._finish(item_id, None, None)
+            return
+        self._finish(item_id, key, image)
+
+    def _prepare_on_pool(self) -> None:
+        # Like prepare_images, at most 2 * workers photos are in flight at once
+        with process_pool(self.workers) as pool:
+            pending: dict = {}
+            while True:
+                while len(pending) < 2 * self.workers and not self._closed:
+                    item = self._next()
+                    if item is None:
+                        break
+                    item_id, source, digest = item
+                    try:
+                        key = (Path(source.name).name, digest or source_digest(source))
+                    except OSError:
+                        self._finish(item_id, None, None)
+                        continue
+                    with self._lock:
+                        image = self._prepared.get(key)
+                    if image is not None:
+                        self._finish(item_id, key, image)
+                        continue
+                    future = pool.submit(
+                        prepare_image,
+                        portable_source(source),
+                        self.box_cm,
+                        self.preset,
+                        key[1],
+                        _cached_probe(key[1]),
+                    )
+                    pending[future] = (item_id, key)
+                if not pending:
+                    return
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item_id, key = pending.pop(future)
+                    try:
+                        self._finish(item_id, key, future.result())
+                    except Exception:
+                        self._finish(item_id, None, None)
+
+    def _finish(self, item_id, key, image: PreparedImage | None) -> None:
+        with self._lock:
+            if item_id not in self._status:
+                return  # forgotten while it was being prepared
+            if image is None:
+                self._status[item_id] = "failed"
+                return
+            self._status[item_id] = "ready"
+            self._keys[item_id] = key
+            self._prepared[key] = image
+
+
+def portable_source(source):
+    """Paths travel to worker processes as-is; in-memory files as a bare NamedBuffer."""
+    if hasattr(source, "getvalue") and type(source) is not NamedBuffer:
+        return NamedBuffer(*read_source(source))
+    return source
+
+
+def _stored_size(size: Tuple[int, int], target: Tuple[int, int], orientation: int) -> Tuple[int, int]:
+    """Size the stored (un-rotated) pixels must keep for the upright photo to fill `target`."""
+    w, h = size if orientation < 5 else (size[1], size[0])
+    scale = min(target[0] / w, target[1] / h, 1)
+    fitted = (math.ceil(w * scale), math.ceil(h * scale))
+    return fitted if orientation < 5 else (fitted[1], fitted[0])
+
+
+def _encode(img: Image.Image, quality: int) -> bytes:
+    bio = io.BytesIO()
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img.save(bio, format="PNG", optimize=True)
+    else:
+        img.convert("RGB").save(bio, format="JPEG", quality=quality, optimize=True)
+    return bio.getvalue()
@@ -0,0 +1,419 @@
+from pathlib import Path
+from PIL import Image
+import io
+import tempfile
+import threading
+import time
+import zlib
+from typing import BinaryIO, Callable, List, Tuple
+
+from pop_images import prepare_images
+from pop_trace import NULL_TRACE, BuildTrace
+from pop_utils_web import (
+    BACKGROUND_PATH,
+    DEFAULT_PHOTO_LAYOUT,
+    GAWK_GREEN,
+    LOGO_PATH,
+    PURPLE,
+    SPOOL_MAX_BYTES,
+    BuildCancelled,
+    PhotoLayout,
+    PhotoName,
+    collect_images,
+    parse_photo_names,
+    report_filename,
+    resolve_photo_layout,
+)
+
+# PDFs are for reading on screen and emailing, so photos are downsampled harder
+# than in the deck by default
+DEFAULT_PDF_PRESET = "email"
+
+# A4 landscape, the template's slide size
+PAGE_CM = (29.7, 21.0)
+PT_PER_CM = 72 / 2.54
+EMU_PER_PT = 12700
+
+# Deflate level for page content and PNG pixel data
+PDF_DEFLATE_LEVEL = 6
+
+# Montserrat isn't available offline, so text is set in the PDF base font
+# Helvetica-Bold (no embedding needed). Its advance widths for ASCII 32-126, in
+# 1/1000 em, are used to centre text.
+FONT_NAME = "Helvetica-Bold"
+_HELVETICA_BOLD_WIDTHS = (
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+)
+
+# PowerPoint text box insets and the share of the font size above the baseline
+TEXT_INSET_CM = (0.254, 0.127)
+ASCENT = 0.968
+
+WHITE = (0xFF, 0xFF, 0xFF)
+
+
+class PdfWriter:
+    """
+    Writes a PDF one object at a time, so pages go to `f` as soon as they are
+    drawn and only the object offsets are kept in memory.
+
+    The page tree is written last; its object number is reserved up front so
+    pages can point at it.
+    """
+
+    def __init__(self, f: BinaryIO, cancel: threading.Event | None = None):
+        self._f = f
+        self._cancel = cancel
+        self._offsets: List[int] = []
+        self._pages: List[int] = []
+        self.written = 0
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._catalog = self.reserve()
+        self._page_tree = self.reserve()
+
+    def _write(self, data: bytes) -> None:
+        if self._cancel is not None and self._cancel.is_set():
+            raise BuildCancelled("Build cancelled.")
+        self._f.write(data)
+        self.written += len(data)
+
+    def reserve(self) -> int:
+        self._offsets.append(0)
+        return len(self._offsets)
+
+    def add(self, body: bytes, num: int | None = None) -> int:
+        """Write an object (its dictionary or value as bytes); return its number."""
+        num = num or self.reserve()
+        self._offsets[num - 1] = self.written
+        self._write(b"%d 0 obj\n%s\nendobj\n" % (num, body))
+        return num
+
+    def add_stream(self, entries: bytes, data: bytes) -> int:
+        return self.add(b"<< %s /Length %d >>\nstream\n%s\nendstream" % (entries, len(data), data))
+
+    def add_page(self, content: bytes, images: dict, font: int) -> int:
+        """Add a page drawing `content`, which refers to `images` ({name: object}) and /F1."""
+        stream = self.add_stream(b"/Filter /FlateDecode", zlib.compress(content, PDF_DEFLATE_LEVEL))
+        xobjects = b" ".join(b"/%s %d 0 R" % (name.encode(), num) for name, num in images.items())
+        page = self.add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %s %s] "
+            b"/Resources << /Font << /F1 %d 0 R >> /XObject << %s >> >> /Contents %d 0 R >>"
+            % (self._page_tree, _pt(PAGE_CM[0]), _pt(PAGE_CM[1]), font, xobjects, stream)
+        )
+        self._pages.append(page)
+        return page
+
+    def close(self) -> None:
+        kids = b" ".join(b"%d 0 R" % page for page in self._pages)
+        self.add(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self._pages)), self._page_tree)
+        self.add(b"<< /Type /Catalog /Pages %d 0 R >>" % self._page_tree, self._catalog)
+
+        xref = self.written
+        lines = [b"xref\n0 %d\n" % (len(self._offsets) + 1), b"0000000000 65535 f \n"]
+        lines += [b"%010d 00000 n \n" % offset for offset in self._offsets]
+        self._write(b"".join(lines))
+        self._write(
+            b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (len(self._offsets) + 1, self._catalog, xref)
+        )
+
+
+def add_image(pdf: PdfWriter, blob: bytes) -> int:
+    """
+    Add a JPEG or PNG as an image XObject; return its object number.
+    Baseline and progressive JPEGs are embedded as they are (DCTDecode);
+    anything else is decoded and deflated, with transparency as a soft mask.
+    """
+    with Image.open(io.BytesIO(blob)) as img:
+        if img.format == "JPEG" and img.mode in ("RGB", "L", "CMYK"):
+            entries = _image_entries(img.size, img.mode) + b" /Filter /DCTDecode"
+            if img.mode == "CMYK":
+                # Adobe CMYK JPEGs store inverted values
+                entries += b" /Decode [1 0 1 0 1 0 1 0]"
+            return pdf.add_stream(entries, blob)
+
+        img.load()
+        smask = None
+        if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+            alpha = img.convert("RGBA").getchannel("A")
+            smask = pdf.add_stream(
+                _image_entries(alpha.size, "L") + b" /Filter /FlateDecode",
+                zlib.compress(alpha.tobytes(), PDF_DEFLATE_LEVEL),
+            )
+        pixels = img.convert("L" if img.mode in ("1", "L", "LA") else "RGB")
+        entries = _image_entries(pixels.size, pixels.mode) + b" /Filter /FlateDecode"
+        if smask:
+            entries += b" /SMask %d 0 R" % smask
+        return pdf.add_stream(entries, zlib.compress(pixels.tobytes(), PDF_DEFLATE_LEVEL))
+
+
+def _image_entries(size: Tuple[int, int], mode: str) -> bytes:
+    space = {"L": b"/DeviceGray", "RGB": b"/DeviceRGB", "CMYK": b"/DeviceCMYK"}[mode]
+    return b"/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s /BitsPerComponent 8" % (
+        (*size, space)
+    )
+
+
+def text_width(text: str, size: float) -> float:
+    """Width of `text` set in FONT_NAME at `size` points, in points."""
+    em = sum(_HELVETICA_BOLD_WIDTHS[ord(c) - 32] if 32 <= ord(c) <= 126 else 556 for c in text)
+    return em * size / 1000
+
+
+class _Page:
+    """Builds the content stream of one page, placing things in slide cm from the top left."""
+
+    def __init__(self):
+        self.ops: List[bytes] = []
+        self.images: dict = {}
+
+    def image(self, num: int, x: float, y: float, w: float, h: float) -> None:
+        name = f"Im{len(self.images)}"
+        self.images[name] = num
+        self.ops.append(
+            b"q %s 0 0 %s %s %s cm /%s Do Q"
+            % (_pt(w), _pt(h), _pt(x), _pt(PAGE_CM[1] - y - h), name.encode())
+        )
+
+    def rect(self, x: float, y: float, w: float, h: float, color) -> None:
+        bottom = PAGE_CM[1] - y - h
+        self.ops.append(b"%s rg %s %s %s %s re f" % (_color(color), _pt(x), _pt(bottom), _pt(w), _pt(h)))
+
+    def text(self, x: float, y: float, lines, size: float, color, line_pt: float = 0) -> None:
+        """
+        Set `lines` left-aligned in a text box whose top-left corner is (x, y),
+        `line_pt` apart (default: single spacing).
+        """
+        line_pt = line_pt or size * 1.2
+        if isinstance(lines, str):
+            lines = [lines]
+        left = (x + TEXT_INSET_CM[0]) * PT_PER_CM
+        baseline = (PAGE_CM[1] - y - TEXT_INSET_CM[1]) * PT_PER_CM - size * ASCENT
+        for line in lines:
+            self.ops.append(
+                b"BT %s rg /F1 %s Tf %s %s Td (%s) Tj ET"
+                % (_color(color), _num(size), _num(left), _num(baseline), _pdf_string(line))
+            )
+            baseline -= line_pt
+
+    def label(self) -> None:
+        """The vertical 'PROOF OF POSTING' on the green strip, reading bottom to top."""
+        text, size = "PROOF OF POSTING", 16
+        # The slide's 20.71 x 0.94cm box turned 270 degrees about its centre
+        centre_x, centre_y, box_h = 0.625, 10.43, 0.94
+        baseline = (centre_x - box_h / 2 + TEXT_INSET_CM[1]) * PT_PER_CM + size * ASCENT
+        start = (PAGE_CM[1] - centre_y) * PT_PER_CM - text_width(text, size) / 2
+        self.ops.append(
+            b"BT %s rg /F1 %s Tf 0 1 -1 0 %s %s Tm (%s) Tj ET"
+            % (_color(PURPLE), _num(size), _num(baseline), _num(start), _pdf_string(text))
+        )
+
+    def content(self) -> bytes:
+        return b"\n".join(self.ops)
+
+
+def _num(value: float) -> bytes:
+    return (b"%.2f" % value).rstrip(b"0").rstrip(b".")
+
+
+def _pt(cm: float) -> bytes:
+    return _num(cm * PT_PER_CM)
+
+
+def _color(color) -> bytes:
+    return b" ".join(_num(c / 255) for c in color)
+
+
+def _pdf_string(text: str) -> bytes:
+    data = text.encode("cp1252", errors="replace")
+    return data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+class _Chrome:
+    """The images every page shares, added to the PDF once."""
+
+    def __init__(self, pdf: PdfWriter):
+        self.font = pdf.add(
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>"
+            % FONT_NAME.encode()
+        )
+        self.background = add_image(pdf, BACKGROUND_PATH.read_bytes())
+        self.logo = add_image(pdf, LOGO_PATH.read_bytes())
+
+    def page(self, photos=()) -> _Page:
+        """
+        A page with the background, logo, green strip and vertical label.
+        `photos` are (image object, x, y, width, height) in cm, drawn under
+        the logo as on the slide.
+        """
+        page = _Page()
+        page.image(self.background, 0, -0.01, 29.7, 21)
+        for photo in photos:
+            page.image(*photo)
+        page.image(self.logo, 23.8, 1.52, 4.49, 1.46)
+        page.rect(0, 0, 1.22, 21, GAWK_GREEN)
+        page.label()
+        return page
+
+
+def _cover_page(chrome: _Chrome, first_info: PhotoName) -> _Page:
+    """The template's front slide with the fields `_add_front_slide_content` fills in."""
+    page = chrome.page()
+    page.text(2.93, 3.66, ["The proof is", "in the posting…"], 72, GAWK_GREEN, line_pt=74.6)
+    page.text(2.93, 9.72, first_info.client, 60, WHITE)
+    page.text(2.93, 15.74, first_info.campaign, 36, GAWK_GREEN)
+    page.text(2.93, 17.89, first_info.month_year, 36, WHITE)
+    return page
+
+
+def _pop_page(chrome: _Chrome, layout: PhotoLayout, photos: list) -> _Page:
+    """
+    A PoP page laid out as `_draw_pop_slide` lays out the slide: `photos`
+    are (details, image object, pixel size), one per cell of `layout`.
+    """
+    page = chrome.page(
+        [
+            (num, *(emu / EMU_PER_PT / PT_PER_CM for emu in layout.place(index, size)))
+            for index, (_, num, size) in enumerate(photos)
+        ]
+    )
+    size = layout.caption_pt
+    for cell, (details, _, _) in zip(layout.cells, photos):
+        page.text(*cell.site_label_cm[:2], "Site:", size, GAWK_GREEN)
+        page.text(*cell.site_cm[:2], details.site_name, size, WHITE)
+        page.text(*cell.date_label_cm[:2], "Live Date:", size, GAWK_GREEN)
+        page.text(*cell.date_cm[:2], details.live_date_display, size, WHITE)
+    return page
+
+
+def _closing_page(chrome: _Chrome) -> _Page:
+    """The template's closing slide."""
+    page = chrome.page()
+    page.text(2.73, 5.66, ["Gotta love", "rectangles"], 110, GAWK_GREEN, line_pt=110)
+    page.text(2.93, 14.57, ["Have a ripper day.", "Onya!"], 48, WHITE, line_pt=57)
+    return page
+
+
+def pdf_filename(info: PhotoName) -> str:
+    """Suggested download name for the PDF of the report whose first photo parsed to `info`."""
+    return str(Path(report_filename(info)).with_suffix(".pdf"))
+
+
+def generate_presentation_pdf(
+    image_paths: List[Path],
+    out=None,
+    image_preset=DEFAULT_PDF_PRESET,
+    workers: int | None = None,
+    progress: Callable[[dict], None] | None = None,
+    cancel: threading.Event | None = None,
+    trace: BuildTrace | None = None,
+    photo_layout=DEFAULT_PHOTO_LAYOUT,
+) -> Tuple[BinaryIO | Path, str]:
+    """
+    Render the PoP report straight to PDF: the cover, a page per slide of
+    `photo_layout` (one per photo by default) and the closing page, laid out
+    like the slides. Nothing goes through
+    PowerPoint and only local assets are used.
+
+    Takes the same inputs and returns the same way as
+    `generate_presentation_file` (photos sorted and parsed the same way, invalid
+    names skipped). Each page is written to `out` as soon as it is drawn and
+    photos are prepared a few at a time, so memory stays flat however long the
+    report is. A photo that appears more than once is embedded once.
+
+    `progress` receives {"stage", "slides_done", "slides_total", "bytes_written"}
+    (counting photos) with stage "preparing", "building" (once per page) and "done"; setting
+    `cancel` stops at the next write with BuildCancelled. `trace` records the
+    same spans as a deck build, with "pages" in place of "slides".
+    """
+    tracer = trace if trace is not None else NULL_TRACE
+    layout = resolve_photo_layout(photo_layout)
+    image_files = collect_images(image_paths, tracer)
+    with tracer.span("parse"):
+        names = parse_photo_names(image_files)
+    first_info = names[0]
+    if not first_info.valid:
+        raise ValueError("First image filename is invalid. Cannot determine client/campaign/date.")
+    photos = [(source, details) for source, details in zip(image_files, names) if details.valid]
+
+    if out is None:
+        out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, suffix=".pdf")
+    if isinstance(out, (str, Path)):
+        out = Path(out)
+        with open(out, "wb") as f:
+            _write_pdf(
+                f, first_info, photos, layout, image_preset, workers, progress, cancel, tracer
+            )
+    else:
+        _write_pdf(
+            out, first_info, photos, layout, image_preset, workers, progress, cancel, tracer
+        )
+        if out.seekable():
+            out.seek(0)
+
+    if trace is not None:
+        trace.finish()
+    return out, pdf_filename(first_info)
+
+
+def _write_pdf(
+    f, first_info, photos, layout: PhotoLayout, image_preset, workers, progress, cancel, trace
+) -> None:
+    pdf = PdfWriter(f, cancel)
+
+    def report(stage: str, done: int) -> None:
+        if progress:
+            progress(
+                {
+                    "stage": stage,
+                    "slides_done": done,
+                    "slides_total": len(photos),
+                    "bytes_written": pdf.written,
+                }
+            )
+
+    report("preparing", 0)
+    chrome = _Chrome(pdf)
+    _add(pdf, chrome, _cover_page(chrome, first_info))
+
+    images = prepare_images([source for source, _ in photos], layout.box_cm, image_preset, workers)
+    embedded: dict = {}
+    pages = 0
+    try:
+        with trace.span("pages"):
+            for first in range(0, len(photos), layout.per_slide):
+                started = time.perf_counter()
+                page_photos = [
+                    (details, next(images))
+                    for _, details in photos[first : first + layout.per_slide]
+                ]
+                prepared = time.perf_counter()
+                placed = []
+                for details, image in page_photos:
+                    num = embedded.get(image.sha1)
+                    if num is None:
+                        # Only the object number is kept, not the image
+                        num = embedded[image.sha1] = add_image(pdf, image.blob)
+                    placed.append((details, num, image.size))
+                _add(pdf, chrome, _pop_page(chrome, layout, placed))
+                pages += 1
+                trace.record("prepare_image", prepared - started)
+                trace.record("render_page", time.perf_counter() - prepared)
+                report("building", first + len(placed))
+    finally:
+        images.close()
+    trace.count("pages", pages + 2)
+    trace.count("media", len(embedded))
+
+    _add(pdf, chrome, _closing_page(chrome))
+    pdf.close()
+    report("done", len(photos))
+
+
+def _add(pdf: PdfWriter, chrome: _Chrome, page: _Page) -> None:
+    pdf.add_page(page.content(), page.images, chrome.font)
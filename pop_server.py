@@ -0,0 +1,601 @@
+from pathlib import Path
+import argparse
+import asyncio
+import email.message
+import email.parser
+import email.policy
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import List
+from urllib.parse import quote, urlsplit
+
+from pop_batch import generate_batch_zip, group_by_report
+from pop_images import DEFAULT_IMAGE_PRESET, resolve_preset
+from pop_utils_web import collect_images, generate_presentation_file, warm_template_cache
+
+logger = logging.getLogger("pop_server")
+
+# Downloads and uploads are streamed in chunks of this size
+CHUNK_BYTES = 1024 * 1024
+
+# Largest JSON request body, and largest header block or text field of a multipart part
+JSON_MAX_BYTES = 1024 * 1024
+PART_HEADER_MAX_BYTES = 16 * 1024
+FIELD_MAX_BYTES = 64 * 1024
+
+PPTX_MIME = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str, headers: dict | None = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class Job:
+    """One report build: its inputs, working directory, state and result."""
+
+    def __init__(self, workdir: Path, sources: list, groups: dict, image_preset):
+        self.id = workdir.name
+        self.workdir = workdir
+        self.sources = sources
+        # Validly named photos per report, as group_by_report split them
+        self.groups = groups
+        self.image_preset = image_preset
+        self.status = "queued"
+        self.progress = {"stage": "queued", "done": 0, "total": 0}
+        self.error = None
+        self.name = None
+        self.path = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.future = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "progress": dict(self.progress),
+            "error": self.error,
+            "name": self.name,
+            "photos": len(self.sources),
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "download": f"/jobs/{self.id}/download" if self.status == "done" else None,
+        }
+
+
+class JobService:
+    """
+    Runs report builds on a bounded pool of `jobs` threads.
+
+    Each build still prepares its photos on worker processes, so the threads
+    mostly wait; the pool size caps how many builds share the CPUs at once.
+    At most `queue_size` jobs may wait for a free slot. Finished jobs and
+    their files are deleted `retention` seconds after they finish.
+    """
+
+    def __init__(
+        self,
+        jobs: int = 2,
+        queue_size: int = 16,
+        retention: float = 3600,
+        roots: List[Path] | None = None,
+        image_workers: int | None = None,
+    ):
+        self.jobs: dict = {}
+        self.queue_size = queue_size
+        self.retention = retention
+        self.roots = [Path(r).resolve() for r in roots or []]
+        # Split the CPUs between concurrent builds instead of oversubscribing them
+        self.image_workers = image_workers or max(1, (os.cpu_count() or 1) // jobs)
+        # Jobs are created from executor threads and read from the event loop
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="pop-job")
+        self._base = Path(tempfile.mkdtemp(prefix="pop_jobs_"))
+
+    def new_workdir(self) -> Path:
+        workdir = self._base / uuid.uuid4().hex
+        workdir.mkdir()
+        return workdir
+
+    def check_paths(self, paths: list) -> List[Path]:
+        """Resolve directory/file references from a request, refusing anything outside `roots`."""
+        resolved = []
+        for p in paths:
+            if not isinstance(p, str):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "'paths' must be a list of strings.")
+            path = Path(p).expanduser().resolve()
+            if self.roots and not any(path.is_relative_to(root) for root in self.roots):
+                raise HTTPError(HTTPStatus.FORBIDDEN, f"{p} is outside the allowed folders.")
+            if not path.exists():
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"No such file or directory: {p}")
+            resolved.append(path)
+        return resolved
+
+    def submit(self, workdir: Path, sources: list, image_preset) -> Job:
+        """Queue a build; raises HTTPError when the inputs are unusable or the queue is full."""
+        try:
+            resolve_preset(image_preset)
+            sources = collect_images(sources)
+            groups = group_by_report(sources)
+        except (ValueError, FileNotFoundError) as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e)) from None
+        if not groups:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "No validly named photos found; nothing to build.")
+
+        job = Job(workdir, sources, groups, image_preset)
+        with self._lock:
+            queued = sum(1 for j in self.jobs.values() if j.status == "queued")
+            if queued >= self.queue_size:
+                raise HTTPError(
+                    HTTPStatus.SERVICE_UNAVAILABLE, "Too many queued jobs.", {"Retry-After": "30"}
+                )
+            self.jobs[job.id] = job
+            job.future = self._pool.submit(self._run, job)
+        logger.info("Job %s queued: %d photos", job.id, len(sources))
+        return job
+
+    def all(self) -> List[Job]:
+        with self._lock:
+            return list(self.jobs.values())
+
+    def get(self, job_id: str) -> Job:
+        try:
+            return self.jobs[job_id]
+        except KeyError:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"No job {job_id}.") from None
+
+    def delete(self, job_id: str) -> None:
+        """Cancel a queued job or discard a finished one."""
+        job = self.get(job_id)
+        if job.status == "running":
+            raise HTTPError(HTTPStatus.CONFLICT, "Job is running; delete it once it has finished.")
+        if job.status == "queued" and not job.future.cancel():
+            raise HTTPError(HTTPStatus.CONFLICT, "Job has just started.")
+        self._discard(job)
+
+    def expire(self) -> None:
+        cutoff = time.time() - self.retention
+        for job in self.all():
+            if job.finished is not None and job.finished < cutoff:
+                self._discard(job)
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        shutil.rmtree(self._base, ignore_errors=True)
+
+    def _discard(self, job: Job) -> None:
+        with self._lock:
+            self.jobs.pop(job.id, None)
+        shutil.rmtree(job.workdir, ignore_errors=True)
+
+    def _run(self, job: Job) -> None:
+        job.status = "running"
+        job.started = time.time()
+        groups = len(job.groups)
+        job.progress = {"stage": "building", "done": 0, "total": groups}
+        try:
+            if groups > 1:
+                out = job.workdir / "reports.zip"
+
+                def on_deck(event):
+                    job.progress = {"stage": "building", "done": event["done"], "total": event["total"]}
+
+                _, results = generate_batch_zip(
+                    job.sources, out, job.image_preset, jobs=self.image_workers, progress=on_deck
+                )
+                failed = [r for r in results if r["error"]]
+                if failed:
+                    raise RuntimeError(
+                        "; ".join(f"{r['name']}: {r['error']}" for r in failed)
+                    )
+                job.name = "PoP Reports.zip"
+            else:
+
+                def on_slide(event):
+                    job.progress = {
+                        "stage": event["stage"],
+                        "done": event["slides_done"],
+                        "total": event["slides_total"],
+                        "bytes_written": event["bytes_written"],
+                    }
+
+                # Only the validly named photos; strays would otherwise fail the whole report
+                (sources,) = job.groups.values()
+                out, job.name = generate_presentation_file(
+                    sources,
+                    job.workdir / "report.pptx",
+                    job.image_preset,
+                    self.image_workers,
+                    progress=on_slide,
+                )
+            job.path = out
+            job.progress = {**job.progress, "stage": "done"}
+            job.status = "done"
+            logger.info("Job %s done in %.1fs", job.id, time.time() - job.started)
+        except Exception as e:
+            job.error = str(e)
+            job.progress = {**job.progress, "stage": "failed"}
+            job.status = "failed"
+            logger.exception("Job %s failed", job.id)
+        finally:
+            job.finished = time.time()
+
+
+class PopServer:
+    """
+    Minimal HTTP/1.1 front end for JobService, one request per connection.
+
+        POST   /jobs                 multipart photos, or JSON {"paths": [...]}
+        GET    /jobs                 all jobs
+        GET    /jobs/{id}            status and progress
+        GET    /jobs/{id}/download   the finished .pptx (or .zip for several reports)
+        DELETE /jobs/{id}            cancel a queued job or discard a finished one
+        GET    /health
+
+    Both request forms accept an optional "image_preset". Uploads are parsed
+    as they stream in, each photo written straight to the job's directory, so
+    a request holds about a chunk in memory whatever its size. Blocking work
+    (writing uploads, reading downloads) runs off the event loop, so status
+    requests are answered while uploads and builds are going on.
+    """
+
+    def __init__(self, service: JobService, max_upload_bytes: int):
+        self.service = service
+        self.max_upload_bytes = max_upload_bytes
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        method = path = None
+        try:
+            try:
+                request = await self._read_head(reader)
+                if request is None:
+                    return
+                method, path, headers = request
+                await self._route(method, path, headers, reader, writer)
+            except HTTPError as e:
+                await self._send_json(writer, e.status, {"error": str(e)}, e.headers)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                raise
+            except Exception:
+                logger.exception("Error handling %s %s", method, path)
+                await self._send_json(
+                    writer, HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Internal server error."}
+                )
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, headers, reader, writer) -> None:
+        parts = [p for p in path.split("/") if p]
+        loop = asyncio.get_running_loop()
+
+        if parts == ["health"] and method == "GET":
+            await self._send_json(writer, HTTPStatus.OK, {"status": "ok", "jobs": len(self.service.jobs)})
+        elif parts == ["jobs"] and method == "POST":
+            job = await self._create_job(headers, reader)
+            await self._send_json(
+                writer, HTTPStatus.ACCEPTED, job.to_dict(), {"Location": f"/jobs/{job.id}"}
+            )
+        elif parts == ["jobs"] and method == "GET":
+            await self._send_json(
+                writer, HTTPStatus.OK, [job.to_dict() for job in self.service.all()]
+            )
+        elif len(parts) == 2 and parts[0] == "jobs" and method == "GET":
+            await self._send_json(writer, HTTPStatus.OK, self.service.get(parts[1]).to_dict())
+        elif len(parts) == 2 and parts[0] == "jobs" and method == "DELETE":
+            self.service.delete(parts[1])
+            await self._send(writer, HTTPStatus.NO_CONTENT)
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "download" and method == "GET":
+            await self._send_download(writer, self.service.get(parts[1]))
+        elif parts[:1] in (["jobs"], ["health"]):
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} not allowed on {path}.")
+        else:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"No route {path}.")
+
+    async def _create_job(self, headers: dict, reader: asyncio.StreamReader) -> Job:
+        content_type = headers.get("content-type", "")
+        loop = asyncio.get_running_loop()
+        workdir = self.service.new_workdir()
+        try:
+            if content_type.startswith("multipart/form-data"):
+                sources, fields = await self._receive_uploads(reader, headers, workdir)
+                preset = fields.get("image_preset", DEFAULT_IMAGE_PRESET)
+            elif content_type.startswith("application/json"):
+                body = await self._read_body(reader, headers, JSON_MAX_BYTES)
+                try:
+                    data = json.loads(body)
+                except ValueError:
+                    raise HTTPError(HTTPStatus.BAD_REQUEST, "Request body is not valid JSON.") from None
+                if not isinstance(data, dict) or not isinstance(data.get("paths"), list):
+                    raise HTTPError(HTTPStatus.BAD_REQUEST, 'Expected {"paths": [...]}.')
+                sources = self.service.check_paths(data["paths"])
+                preset = data.get("image_preset", DEFAULT_IMAGE_PRESET)
+            else:
+                raise HTTPError(
+                    HTTPStatus.UNSUPPORTED_MEDIA_TYPE,
+                    "Send photos as multipart/form-data or paths as application/json.",
+                )
+            return await loop.run_in_executor(None, self.service.submit, workdir, sources, preset)
+        except BaseException:
+            shutil.rmtree(workdir, ignore_errors=True)
+            raise
+
+    async def _receive_uploads(self, reader: asyncio.StreamReader, headers: dict, workdir: Path):
+        """
+        Stream a multipart body into `workdir` as it arrives, a chunk at a time;
+        return (photo paths, text fields).
+        """
+        remaining = self._content_length(headers, self.max_upload_bytes)
+        receiver = _MultipartReceiver(headers["content-type"], workdir)
+        loop = asyncio.get_running_loop()
+        try:
+            while remaining:
+                chunk = await reader.read(min(CHUNK_BYTES, remaining))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b"", remaining)
+                remaining -= len(chunk)
+                await loop.run_in_executor(None, receiver.feed, chunk)
+        finally:
+            receiver.close()
+        if not receiver.complete:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed multipart body.")
+        if not receiver.paths:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "No photos in the upload.")
+        return receiver.paths, receiver.fields
+
+    async def _send_download(self, writer: asyncio.StreamWriter, job: Job) -> None:
+        if job.status != "done":
+            raise HTTPError(HTTPStatus.CONFLICT, f"Job is {job.status}, not done.")
+
+        loop = asyncio.get_running_loop()
+        path = Path(job.path)
+        await self._send(
+            writer,
+            HTTPStatus.OK,
+            headers={
+                "Content-Type": "application/zip" if path.suffix == ".zip" else PPTX_MIME,
+                "Content-Length": str(path.stat().st_size),
+                "Content-Disposition": f"attachment; filename*=UTF-8''{quote(job.name)}",
+            },
+        )
+        with open(path, "rb") as f:
+            while chunk := await loop.run_in_executor(None, f.read, CHUNK_BYTES):
+                writer.write(chunk)
+                await writer.drain()
+
+    async def _read_head(self, reader: asyncio.StreamReader):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line.") from None
+
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return method.upper(), urlsplit(target).path, headers
+
+    def _content_length(self, headers: dict, limit: int) -> int:
+        if "content-length" not in headers:
+            raise HTTPError(HTTPStatus.LENGTH_REQUIRED, "Content-Length is required.")
+        try:
+            length = int(headers["content-length"])
+        except ValueError:
+            length = -1
+        if length < 0:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Content-Length must be a non-negative integer.")
+        if length > limit:
+            raise HTTPError(
+                HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                f"Request bodies are limited to {limit // (1024 * 1024)} MB.",
+            )
+        return length
+
+    async def _read_body(self, reader: asyncio.StreamReader, headers: dict, limit: int) -> bytes:
+        limit = min(limit, self.max_upload_bytes)
+        return await reader.readexactly(self._content_length(headers, limit))
+
+    async def _send_json(self, writer, status: HTTPStatus, data, headers: dict | None = None) -> None:
+        body = json.dumps(data).encode()
+        await self._send(
+            writer,
+            status,
+            body,
+            {"Content-Type": "application/json", "Content-Length": str(len(body)), **(headers or {})},
+        )
+
+    async def _send(self, writer, status: HTTPStatus, body: bytes = b"", headers: dict | None = None) -> None:
+        head = [f"HTTP/1.1 {status.value} {status.phrase}", "Connection: close"]
+        head += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+
+class _MultipartReceiver:
+    """
+    Incremental multipart/form-data parser. Each file part is written into
+    `workdir` under its own name as its bytes are fed in, so only about one
+    chunk is ever held in memory; text fields are kept in `fields`.
+    """
+
+    def __init__(self, content_type: str, workdir: Path):
+        message = email.message.Message()
+        message["Content-Type"] = content_type
+        boundary = message.get_param("boundary")
+        if not boundary:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Multipart body without a boundary.")
+        self.workdir = workdir
+        self.paths: List[Path] = []
+        self.fields: dict = {}
+        self.complete = False
+        self._delimiter = b"\r\n--" + boundary.encode("latin-1")
+        # A leading CRLF makes the first delimiter look like all the others
+        self._buffer = bytearray(b"\r\n")
+        self._state = "preamble"
+        self._file = None
+        self._field = None
+        self._field_name = None
+
+    def feed(self, data: bytes) -> None:
+        self._buffer += data
+        while self._step():
+            pass
+
+    def close(self) -> None:
+        """Close the file being written, if any; an unfinished body leaves `complete` False."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _step(self) -> bool:
+        # Consume what the buffer allows in the current state; False once more input is needed
+        buffer = self._buffer
+        if self._state in ("preamble", "part"):
+            end = buffer.find(self._delimiter)
+            if end < 0:
+                # Keep a tail that could be the start of a delimiter split across chunks
+                keep = len(self._delimiter) - 1
+                if len(buffer) > keep:
+                    self._write(buffer[:-keep])
+                    del buffer[:-keep]
+                return False
+            self._write(buffer[:end])
+            del buffer[: end + len(self._delimiter)]
+            self._end_part()
+            self._state = "delimiter"
+            return True
+        if self._state == "delimiter":
+            if buffer[:2] == b"--":
+                self.complete = True
+                self._state = "epilogue"
+                return True
+            end = buffer.find(b"\r\n")
+            if end < 0:
+                self._check_header_size()
+                return False
+            del buffer[: end + 2]
+            self._state = "headers"
+            return True
+        if self._state == "headers":
+            if buffer[:2] == b"\r\n":
+                end, head = 0, b""
+            else:
+                end = buffer.find(b"\r\n\r\n")
+                if end < 0:
+                    self._check_header_size()
+                    return False
+                head = bytes(buffer[: end + 2])
+            del buffer[: end + (2 if not head else 4)]
+            self._start_part(head)
+            self._state = "part"
+            return True
+        buffer.clear()  # epilogue
+        return False
+
+    def _check_header_size(self) -> None:
+        if len(self._buffer) > PART_HEADER_MAX_BYTES:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Multipart part headers are too large.")
+
+    def _start_part(self, head: bytes) -> None:
+        part = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(head + b"\r\n")
+        filename = part.get_filename()
+        if filename:
+            name = Path(filename.replace("\\", "/")).name
+            if name in ("", ".", ".."):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"Unusable filename {filename!r}.")
+            path = self.workdir / name
+            if path in self.paths:
+                # Names carry the slide details, so a duplicate can't just be renamed
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"Two photos are named {name!r}.")
+            self.paths.append(path)
+            self._file = open(path, "wb")
+        else:
+            self._field_name = part.get_param("name", header="content-disposition")
+            self._field = bytearray()
+
+    def _write(self, data) -> None:
+        if self._file is not None:
+            self._file.write(data)
+        elif self._field is not None:
+            if len(self._field) + len(data) > FIELD_MAX_BYTES:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Form field is too large.")
+            self._field += data
+
+    def _end_part(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        elif self._field is not None:
+            self.fields[self._field_name] = self._field.decode("utf-8", "replace").strip()
+            self._field = None
+
+
+async def serve(host: str, port: int, service: JobService, max_upload_bytes: int) -> None:
+    warm_template_cache()
+    server = PopServer(service, max_upload_bytes)
+    listener = await asyncio.start_server(server.handle, host, port)
+    logger.info("Listening on http://%s:%d", host, port)
+
+    async def expire_jobs():
+        while True:
+            await asyncio.sleep(60)
+            service.expire()
+
+    expiry = asyncio.create_task(expire_jobs())
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        expiry.cancel()
+        service.close()
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="pop_server.py", description="Local HTTP service for PoP report jobs.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on (default: 8765)")
+    parser.add_argument("-j", "--jobs", type=int, default=2, help="builds run at the same time (default: 2)")
+    parser.add_argument("--queue", type=int, default=16, help="jobs allowed to wait (default: 16)")
+    parser.add_argument(
+        "--retention", type=float, default=3600, help="seconds finished jobs are kept (default: 3600)"
+    )
+    parser.add_argument(
+        "--root",
+        action="append",
+        default=[],
+        help="folder that JSON path references must be inside (repeatable; default: any)",
+    )
+    parser.add_argument(
+        "--max-upload-mb", type=int, default=512, help="largest accepted request body (default: 512)"
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    service = JobService(args.jobs, args.queue, args.retention, args.root)
+    try:
+        asyncio.run(serve(args.host, args.port, service, args.max_upload_mb * 1024 * 1024))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
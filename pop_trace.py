@@ -0,0 +1,229 @@
+from pathlib import Path
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the per-slide histogram buckets
+HISTOGRAM_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class BuildTrace:
+    """
+    Timings for one report build: a span per pipeline stage (nested spans
+    keep their depth), per-slide samples that are summarised as histograms,
+    counters that add up and gauges that hold one reading (such as peak memory).
+
+    Pass one to ReportBuilder.build / generate_presentation_* and read it
+    afterwards. `finish()` hands the trace to each of `sinks` (callables
+    taking the trace), e.g. `log_sink` or `prometheus_file_sink(path)`.
+    """
+
+    def __init__(self, sinks: Iterable[Callable[["BuildTrace"], None]] = ()):
+        self.sinks = list(sinks)
+        self.spans: List[dict] = []
+        self.samples: dict = {}
+        self.counters: dict = {}
+        self.gauges: dict = {}
+        self._origin = time.perf_counter()
+        self._depth = 0
+
+    @contextmanager
+    def span(self, name: str):
+        started = time.perf_counter()
+        span = {"name": name, "depth": self._depth, "start": round(started - self._origin, 6)}
+        self.spans.append(span)
+        self._depth += 1
+        try:
+            yield span
+        finally:
+            self._depth -= 1
+            span["seconds"] = round(time.perf_counter() - started, 6)
+
+    def record(self, name: str, seconds: float) -> None:
+        """Add one per-slide sample (e.g. the time to stamp a slide)."""
+        self.samples.setdefault(name, []).append(seconds)
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float) -> None:
+        """Set a reading such as a size or a peak; a later call replaces it."""
+        self.gauges[name] = value
+
+    def stages(self) -> dict:
+        """Seconds per top-level stage, in the order they ran."""
+        totals: dict = {}
+        for span in self.spans:
+            if span["depth"] == 0:
+                totals[span["name"]] = totals.get(span["name"], 0) + span.get("seconds", 0)
+        return totals
+
+    def histograms(self) -> dict:
+        summary = {}
+        for name, values in self.samples.items():
+            ordered = sorted(values)
+            summary[name] = {
+                "count": len(ordered),
+                "sum": sum(ordered),
+                "mean": sum(ordered) / len(ordered),
+                "p50": _percentile(ordered, 0.50),
+                "p90": _percentile(ordered, 0.90),
+                "p99": _percentile(ordered, 0.99),
+                "max": ordered[-1],
+            }
+        return summary
+
+    def to_dict(self) -> dict:
+        return {
+            "stages": self.stages(),
+            "spans": self.spans,
+            "histograms": self.histograms(),
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+        }
+
+    def finish(self) -> "BuildTrace":
+        for sink in self.sinks:
+            try:
+                sink(self)
+            except Exception:
+                logger.exception("Trace sink %r failed", sink)
+        return self
+
+
+class _NullTrace:
+    """Stand-in used when no trace is wanted; every call is a no-op."""
+
+    def span(self, name: str):
+        return nullcontext()
+
+    def record(self, name: str, seconds: float) -> None:
+        pass
+
+    def count(self, name: str, value: int = 1) -> None:
+        pass
+
+    def gauge(self, name: str, value: float) -> None:
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+def log_sink(trace: BuildTrace) -> None:
+    """Log the trace as one structured (JSON) line."""
+    logger.info(
+        "build trace %s",
+        json.dumps(
+            {
+                "stages": {k: round(v, 4) for k, v in trace.stages().items()},
+                "slides": {
+                    name: {k: round(v, 4) if isinstance(v, float) else v for k, v in h.items()}
+                    for name, h in trace.histograms().items()
+                },
+                "counters": trace.counters,
+                "gauges": trace.gauges,
+            }
+        ),
+    )
+
+
+def prometheus_text(trace: BuildTrace, prefix: str = "pop_build") -> str:
+    """The trace in Prometheus text exposition format."""
+    lines = [
+        f"# HELP {prefix}_stage_seconds Seconds spent in each stage of the last report build.",
+        f"# TYPE {prefix}_stage_seconds gauge",
+    ]
+    lines += [f'{prefix}_stage_seconds{{stage="{name}"}} {seconds:.6f}' for name, seconds in trace.stages().items()]
+
+    lines += [
+        f"# HELP {prefix}_slide_seconds Per-slide step timings of the last report build.",
+        f"# TYPE {prefix}_slide_seconds histogram",
+    ]
+    for name, values in trace.samples.items():
+        for bound in HISTOGRAM_BUCKETS:
+            in_bucket = sum(1 for v in values if v <= bound)
+            lines.append(f'{prefix}_slide_seconds_bucket{{step="{name}",le="{bound}"}} {in_bucket}')
+        lines.append(f'{prefix}_slide_seconds_bucket{{step="{name}",le="+Inf"}} {len(values)}')
+        lines.append(f'{prefix}_slide_seconds_sum{{step="{name}"}} {sum(values):.6f}')
+        lines.append(f'{prefix}_slide_seconds_count{{step="{name}"}} {len(values)}')
+
+    if trace.counters:
+        lines += [f"# TYPE {prefix}_total counter"]
+        lines += [f'{prefix}_total{{counter="{name}"}} {value}' for name, value in trace.counters.items()]
+    for name, value in trace.gauges.items():
+        lines += [f"# TYPE {prefix}_{name} gauge", f"{prefix}_{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def prometheus_file_sink(path) -> Callable[[BuildTrace], None]:
+    """
+    Sink that writes `prometheus_text` to `path`, replacing it atomically
+    (suits node_exporter's textfile collector).
+    """
+    path = Path(path)
+
+    def sink(trace: BuildTrace) -> None:
+        fd, tmp = tempfile.mkstemp(prefix=".pop_trace_", suffix=".prom", dir=path.parent)
+        with os.fdopen(fd, "w") as f:
+            f.write(prometheus_text(trace))
+        os.replace(tmp, path)
+
+    return sink
+
+
+def current_rss() -> int | None:
+    """This process's resident set size in bytes, or None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class PeakMemory:
+    """
+    Samples the resident set size on a background thread while in use and
+    keeps the highest value seen, in bytes (`peak`; None if RSS is unknown).
+
+        with PeakMemory() as memory:
+            ...
+        memory.peak
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak: int | None = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self) -> None:
+        rss = current_rss()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self) -> "PeakMemory":
+        self.sample()
+        self._thread = threading.Thread(target=self._run, name="pop-peak-memory", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+def _percentile(ordered: list, q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
@@ -4,9 +4,40 @@ from pptx import Presentation
 from pptx.util import Cm, Pt
 from pptx.dml.color import RGBColor
 from pptx.enum.text import PP_ALIGN
-from PIL import Image
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+from pptx.opc.oxml import serialize_part_xml
+from pptx.opc.packuri import CONTENT_TYPES_URI, PACKAGE_URI, PackURI
+# Private to python-pptx, like the package/part `_rels` used below; pinned in requirements.txt
+from pptx.opc.serialized import _ContentTypesItem
+from pptx.oxml import parse_xml
+from pptx.parts.image import Image as PptxImage, ImagePart
+from pptx.parts.slide import SlidePart
 import io
-from typing import List, Tuple
+import logging
+import math
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import wait
+from contextlib import nullcontext
+from copy import deepcopy
+from functools import lru_cache
+from lxml import etree
+from typing import BinaryIO, Callable, List, Tuple
+
+from pop_images import (
+    DEFAULT_IMAGE_PRESET,
+    PreparedImage,
+    portable_source,
+    prepare_images,
+    process_pool,
+    resolve_preset,
+    source_digest,
+)
+from pop_trace import NULL_TRACE, BuildTrace, PeakMemory, current_rss
+
+logger = logging.getLogger(__name__)
 
 # Paths
 SCRIPT_DIR = Path(__file__).resolve().parent if "__file__" in globals() else Path(".").resolve()
@@ -16,89 +47,165 @@ TEMPLATE_PATH = ASSETS_DIR / "PoP's Report - Template (Date).pptx"
 LOGO_PATH = ASSETS_DIR / "GAWK LOGO (PURPLE).png"
 BACKGROUND_PATH = ASSETS_DIR / "Background.jpg"
 
+# Box the main PoP photo is fitted into, in cm (width, height)
+IMAGE_BOX_CM = (24.89, 12.87)
+
+# Finished decks larger than this are spooled to disk instead of kept in memory
+SPOOL_MAX_BYTES = 64 * 1024 * 1024
+
+# With a memory budget, finished decks larger than this share of it go to disk
+BUDGET_SPOOL_SHARE = 0.25
+
+# Saving reports progress roughly once per this many bytes written
+PROGRESS_BYTES = 1024 * 1024
+
+# Deflate level for XML parts (zlib's default, as python-pptx uses). Media parts
+# that are already compressed are stored as they are.
+XML_DEFLATE_LEVEL = 6
+STORED_CONTENT_TYPES = frozenset(("image/jpeg", "image/png", "image/gif"))
+
+# A sharded build gives each shard at least this many new slides
+SHARD_MIN_SLIDES = 100
+
+# Template slide layout used for every PoP slide
+BLANK_LAYOUT_INDEX = 5
+
 # Colours
 PURPLE = RGBColor(0x54, 0x2D, 0x54)
 GAWK_GREEN = RGBColor(0xD7, 0xDF, 0x23)
 
 
+@lru_cache(maxsize=1024)
 def convert_date(date_str: str) -> str:
     """Convert DDMMYY to 'MONTH YYYY' in uppercase."""
-    try:
-        return datetime.strptime(date_str, "%d%m%y").strftime("%B %Y").upper()
-    except Exception:
-        return "INVALID DATE"
+    date = _live_date(date_str)
+    return date.strftime("%B %Y").upper() if date else "INVALID DATE"
 
 
+@lru_cache(maxsize=1024)
 def display_date(date_str: str) -> str:
     """Convert DDMMYY to DD/MM/YY for on-slide display."""
+    date = _live_date(date_str)
+    return date.strftime("%d/%m/%y") if date else "INVALID DATE"
+
+
+@lru_cache(maxsize=1024)
+def _live_date(date_str: str) -> datetime | None:
+    # A batch of photos only has a few dozen distinct dates, so each is parsed once
     try:
-        return datetime.strptime(date_str, "%d%m%y").strftime("%d/%m/%y")
+        return datetime.strptime(date_str, "%d%m%y")
     except Exception:
-        return "INVALID DATE"
+        return None
 
 
-def parse_filename(path_like) -> dict | None:
+class PhotoName:
     """
-    Parse filenames in the format:
-    'Site Name - Site Code - Client - Campaign - DDMMYY - Type[ - OptionalSuffix]'.
-    Only the first 6 parts are meaningful for the PoP logic.
+    Everything the report needs from a photo's filename, parsed in one pass:
+    the slide fields, the slide-order `sort_key` and whether the name follows
+
+    'Site Name - Site Code - Client - Campaign - DDMMYY - Type[ - OptionalSuffix]'
+
+    at all (`valid`). Fields of invalid names are None. Get records from
+    `parse_photo_name(s)`, which hands out the same record for a name seen before.
     """
-    # Accept either a Path or an object with a .name attribute (e.g. UploadedFile)
-    if hasattr(path_like, "name"):
-        name = Path(path_like.name)
-    else:
-        name = Path(path_like)
 
-    parts = name.stem.split(" - ")
-    if len(parts) < 6:
-        # Too short to be valid
-        return None
+    __slots__ = (
+        "filename",
+        "valid",
+        "site_name",
+        "client",
+        "campaign",
+        "live_date",
+        "month_year",
+        "live_date_display",
+        "sort_key",
+    )
 
-    try:
-        site_name = f"{parts[0].strip()} - {parts[1].strip()}"
-        client = parts[2].strip()
-        campaign = parts[3].strip()
-        live_date_raw = parts[4].strip()
+    def __init__(self, filename: str):
+        self.filename = filename
+        parts = Path(filename).stem.split(" - ")
+        self.sort_key = _sort_key(filename, parts)
+
+        # Only the first 6 parts are meaningful for the PoP logic
+        self.valid = len(parts) >= 6
+        if self.valid:
+            live_date_raw = parts[4].strip()
+            self.site_name = f"{parts[0].strip()} - {parts[1].strip()}"
+            self.client = parts[2].strip()
+            self.campaign = parts[3].strip()
+            self.live_date = live_date_raw
+            self.month_year = convert_date(live_date_raw)
+            self.live_date_display = display_date(live_date_raw)
+        else:
+            self.site_name = self.client = self.campaign = None
+            self.live_date = self.month_year = self.live_date_display = None
+
+    @property
+    def report_key(self) -> Tuple[str, str, str]:
+        """(client, campaign, month_year): photos sharing it belong in the same report."""
+        return (self.client, self.campaign, self.month_year)
+
+    def as_dict(self) -> dict | None:
+        if not self.valid:
+            return None
         return {
-            "site_name": site_name,
-            "client": client,
-            "campaign": campaign,
-            "live_date": live_date_raw,
-            "month_year": convert_date(live_date_raw),
-            "live_date_display": display_date(live_date_raw),
+            "site_name": self.site_name,
+            "client": self.client,
+            "campaign": self.campaign,
+            "live_date": self.live_date,
+            "month_year": self.month_year,
+            "live_date_display": self.live_date_display,
         }
-    except Exception:
-        return None
 
 
-def extract_live_date_priority(path: Path):
+def _sort_key(filename: str, parts: List[str]) -> tuple:
     """
     Sort key matching desktop script:
     1. By actual live date (earliest first)
     2. Then by base filename (first 5 parts)
     3. Then by suffix priority: Cam (0) < Mock (1) < Others (2)
     """
-    try:
-        name = path.name.lower()
-        parts = path.stem.split(" - ")
-        base_key = " - ".join(parts[:5]).lower()
-        suffix = name.split(" - ")[-1]
-
-        if "cam" in suffix:
-            suffix_priority = 0
-        elif "mock" in suffix:
-            suffix_priority = 1
-        else:
-            suffix_priority = 2
+    date = _live_date(parts[4]) if len(parts) >= 5 else None
+    if date is None:
+        return (datetime.min, filename.lower(), 9)
 
-        date_str = parts[4]
-        date = datetime.strptime(date_str, "%d%m%y")
-        return (date, base_key, suffix_priority)
-    except Exception:
-        return (datetime.min, path.name.lower(), 9)
+    suffix = filename.lower().split(" - ")[-1]
+    if "cam" in suffix:
+        suffix_priority = 0
+    elif "mock" in suffix:
+        suffix_priority = 1
+    else:
+        suffix_priority = 2
+    return (date, " - ".join(parts[:5]).lower(), suffix_priority)
+
+
+@lru_cache(maxsize=16384)
+def _parse_name(filename: str) -> PhotoName:
+    return PhotoName(filename)
+
+
+def parse_photo_name(path_like) -> PhotoName:
+    """Parse a path or an object with a .name attribute (e.g. UploadedFile)."""
+    name = path_like.name if hasattr(path_like, "name") else path_like
+    return _parse_name(Path(name).name)
+
+
+def parse_photo_names(sources) -> List[PhotoName]:
+    """`parse_photo_name` over many sources; repeated names and dates are parsed once."""
+    return [parse_photo_name(source) for source in sources]
 
 
-def _add_front_slide_content(prs: Presentation, first_info: dict) -> None:
+def parse_filename(path_like) -> dict | None:
+    """The fields of `parse_photo_name` as a dict, or None for an invalid name."""
+    return parse_photo_name(path_like).as_dict()
+
+
+def extract_live_date_priority(path_like):
+    """Slide-order sort key for a photo (see `_sort_key`)."""
+    return parse_photo_name(path_like).sort_key
+
+
+def _add_front_slide_content(prs: Presentation, first_info: PhotoName) -> None:
     first_slide = prs.slides[0]
     for shape in first_slide.shapes:
         if not shape.has_text_frame:
@@ -109,7 +216,7 @@ def _add_front_slide_content(prs: Presentation, first_info: dict) -> None:
             shape.text_frame.clear()
             p = shape.text_frame.paragraphs[0]
             r = p.add_run()
-            r.text = first_info["client"]
+            r.text = first_info.client
             r.font.name = "Montserrat"
             r.font.size = Pt(60)
             r.font.bold = True
@@ -118,7 +225,7 @@ def _add_front_slide_content(prs: Presentation, first_info: dict) -> None:
             shape.text_frame.clear()
             p = shape.text_frame.paragraphs[0]
             r = p.add_run()
-            r.text = first_info["month_year"]
+            r.text = first_info.month_year
             r.font.name = "Montserrat"
             r.font.size = Pt(36)
             r.font.bold = True
@@ -127,7 +234,7 @@ def _add_front_slide_content(prs: Presentation, first_info: dict) -> None:
             shape.text_frame.clear()
             p = shape.text_frame.paragraphs[0]
             r = p.add_run()
-            r.text = first_info["campaign"]
+            r.text = first_info.campaign
             r.font.name = "Montserrat"
             r.font.size = Pt(36)
             r.font.bold = True
@@ -146,176 +253,1155 @@ def _add_text(slide, x, y, w, h, text, size=23, bold=True, color=RGBColor(255, 2
     run.font.size = Pt(size)
     run.font.bold = bold
     run.font.color.rgb = color
+    return box
+
+
+# Caption metrics of the single-photo slide at its 23pt, scaled for smaller
+# captions: text box height, and where each value starts after its label
+CAPTION_PT = 23
+_CAPTION_LINE_CM = 1.24
+_SITE_VALUE_CM = 2.3
+_DATE_VALUE_CM = 4.73
+# Caption text boxes start this far left of the photo, so the text lines up with it
+_CAPTION_INSET_CM = 0.34
 
+# Where grid layouts place their cells, in cm (x, y, width, height): the width
+# of the single photo box, from below the logo to above the bottom edge
+GRID_AREA_CM = (3.4, 3.2, 24.89, 16.7)
+GRID_GAP_CM = (0.6, 0.4)
 
-def generate_presentation_bytes(image_paths: List[Path]) -> Tuple[bytes, str]:
+
+class PhotoCell:
     """
-    Core PoP logic reproduced from the desktop GUI script,
-    but saving to an in-memory bytes object instead of using file dialogs.
+    Where one photo and its captions go on a slide. Boxes are (x, y, width,
+    height), given in cm and converted to EMU once: `box` for the photo, then
+    the "Site:" and "Live Date:" labels and the text boxes for their values.
+    """
+
+    __slots__ = (
+        "box_cm",
+        "site_label_cm",
+        "site_cm",
+        "date_label_cm",
+        "date_cm",
+        "box",
+        "site_label",
+        "site",
+        "date_label",
+        "date",
+    )
+
+    def __init__(self, box_cm, site_label_cm, site_cm, date_label_cm, date_cm):
+        self.box_cm = box_cm
+        self.site_label_cm = site_label_cm
+        self.site_cm = site_cm
+        self.date_label_cm = date_label_cm
+        self.date_cm = date_cm
+        for name in ("box", "site_label", "site", "date_label", "date"):
+            setattr(self, name, tuple(Cm(v) for v in getattr(self, f"{name}_cm")))
+
+
+class PhotoLayout:
+    """
+    How PoP slides hold their photos: one `PhotoCell` per photo, filled in
+    slide order, with captions set at `caption_pt`. Photos are fitted to their
+    cell's box at its top left, or with `centred` at the middle of its bottom
+    edge, just above the captions.
     """
-    # Filter & normalise
-    image_files: list[Path] = []
-    for p in image_paths:
-        p = Path(p)
-        if p.is_dir():
-            image_files.extend(
-                f for f in p.glob("*") if f.suffix.lower() in [".jpg", ".jpeg", ".png"]
+
+    __slots__ = ("name", "cells", "caption_pt", "centred")
+
+    def __init__(self, name: str, cells, caption_pt: float = CAPTION_PT, centred: bool = False):
+        self.name = name
+        self.cells = tuple(cells)
+        self.caption_pt = caption_pt
+        self.centred = centred
+
+    @property
+    def per_slide(self) -> int:
+        return len(self.cells)
+
+    @property
+    def box_cm(self) -> Tuple[float, float]:
+        """(width, height) of the photo boxes, which photos are prepared for."""
+        return self.cells[0].box_cm[2:]
+
+    def place(self, index: int, size: Tuple[int, int]) -> Tuple[int, int, int, int]:
+        """(x, y, width, height) in EMU of a photo of `size` pixels in cell `index`."""
+        cell = self.cells[index]
+        box_w, box_h = cell.box_cm[2:]
+        img_aspect = size[0] / size[1]
+        if img_aspect > box_w / box_h:
+            width, height = Cm(box_w), Cm(box_w / img_aspect)
+        else:
+            width, height = Cm(box_h * img_aspect), Cm(box_h)
+
+        x, y, cell_w, cell_h = cell.box
+        if self.centred:
+            x, y = x + (cell_w - width) // 2, y + cell_h - height
+        return x, y, width, height
+
+
+def _grid_layout(name: str, columns: int, rows: int, caption_pt: float) -> PhotoLayout:
+    """`columns` x `rows` cells over GRID_AREA_CM, each photo with both captions below it."""
+    area_x, area_y, area_w, area_h = GRID_AREA_CM
+    gap_x, gap_y = GRID_GAP_CM
+    scale = caption_pt / CAPTION_PT
+    line = _CAPTION_LINE_CM * scale
+    cell_w = (area_w - gap_x * (columns - 1)) / columns
+    cell_h = (area_h - gap_y * (rows - 1)) / rows
+    photo_h = cell_h - 2 * line
+
+    cells = []
+    for row in range(rows):
+        for column in range(columns):
+            x = area_x + column * (cell_w + gap_x)
+            y = area_y + row * (cell_h + gap_y)
+            text_x, text_w = x - _CAPTION_INSET_CM, cell_w + _CAPTION_INSET_CM
+            site_y, date_y = y + photo_h, y + photo_h + line
+            site_at, date_at = _SITE_VALUE_CM * scale, _DATE_VALUE_CM * scale
+            cells.append(
+                PhotoCell(
+                    (x, y, cell_w, photo_h),
+                    (text_x, site_y, 3.09 * scale, line),
+                    (text_x + site_at, site_y, text_w - site_at, line),
+                    (text_x, date_y, 4.76 * scale, line),
+                    (text_x + date_at, date_y, text_w - date_at, line),
+                )
             )
-        elif p.suffix.lower() in [".jpg", ".jpeg", ".png"]:
-            image_files.append(p)
+    return PhotoLayout(name, cells, caption_pt, centred=True)
 
-    image_files = sorted(image_files, key=extract_live_date_priority)
 
-    if not image_files:
-        raise FileNotFoundError("No JPG, JPEG, or PNG files found for PoP generation.")
+# Photo layouts by name. "single" is the original slide: one photo in the
+# 24.89 x 12.87cm box at (3.4, 4.45), site above it and live date below.
+PHOTO_LAYOUTS = {
+    "single": PhotoLayout(
+        "single",
+        [
+            PhotoCell(
+                (3.4, 4.45, *IMAGE_BOX_CM),
+                (3.06, 2.5, 3.09, 1.24),
+                (5.36, 2.5, 13.25, 1.24),
+                (3.06, 18, 4.76, 1.24),
+                (7.79, 18, 12.35, 1.24),
+            )
+        ],
+    ),
+    "2-up": _grid_layout("2-up", 2, 1, 16),
+    "4-up": _grid_layout("4-up", 2, 2, 14),
+    "6-up": _grid_layout("6-up", 3, 2, 11),
+}
+DEFAULT_PHOTO_LAYOUT = "single"
 
-    first_info = parse_filename(image_files[0])
-    if not first_info:
-        raise ValueError("First image filename is invalid. Cannot determine client/campaign/date.")
 
-    prs = Presentation(TEMPLATE_PATH)
-    blank_layout = prs.slide_layouts[5]
+def resolve_photo_layout(layout) -> PhotoLayout:
+    """Accept a layout name or a PhotoLayout; return the PhotoLayout."""
+    if isinstance(layout, PhotoLayout):
+        return layout
+    try:
+        return PHOTO_LAYOUTS[layout]
+    except KeyError:
+        raise ValueError(
+            f"Unknown photo layout {layout!r}. Choose one of: {', '.join(PHOTO_LAYOUTS)}."
+        ) from None
 
-    _add_front_slide_content(prs, first_info)
 
-    for img_path in image_files:
-        details = parse_filename(img_path)
-        if not details:
-            continue
+def _draw_pop_slide(slide, layout: PhotoLayout, photos: list) -> dict:
+    """
+    Draw a PoP slide shape by shape, with every cell of `layout` filled: the
+    (details, image) `photos` in order, any cells past them with the first
+    photo again (they share its image part, so they can be removed cleanly).
+
+    Returns the elements that change from slide to slide, keyed by role, and
+    under "cells" each cell's elements plus all of its shapes.
+    """
+    # Background strip
+    background = slide.shapes.add_picture(
+        str(BACKGROUND_PATH),
+        Cm(0),
+        Cm(-0.01),
+        width=Cm(29.7),
+        height=Cm(21),
+    )
+
+    # Main PoP images, each fitted to its cell's box
+    pictures = []
+    for index in range(layout.per_slide):
+        _, image = photos[index] if index < len(photos) else photos[0]
+        x, y, width, height = layout.place(index, image.size)
+        picture = slide.shapes.add_picture(io.BytesIO(image.blob), x, y, width=width, height=height)
+        picture._element.nvPicPr.cNvPr.set("descr", image.filename)
+        pictures.append(picture._element)
+
+    # Gawk logo top-right
+    logo = slide.shapes.add_picture(
+        str(LOGO_PATH),
+        Cm(23.8),
+        Cm(1.52),
+        width=Cm(4.49),
+        height=Cm(1.46),
+    )
 
-        slide = prs.slides.add_slide(blank_layout)
+    # Gawk green vertical strip
+    rect = slide.shapes.add_shape(
+        1,  # MSO_SHAPE_RECTANGLE
+        Cm(0),
+        Cm(0),
+        Cm(1.22),
+        Cm(21),
+    )
+    rect.fill.solid()
+    rect.fill.fore_color.rgb = GAWK_GREEN
+    rect.line.fill.background()
 
-        # Background strip
-        slide.shapes.add_picture(
-            str(BACKGROUND_PATH),
-            Cm(0),
-            Cm(-0.01),
-            width=Cm(29.7),
-            height=Cm(21),
+    # Vertical 'PROOF OF POSTING'
+    tb = slide.shapes.add_textbox(Cm(-9.73), Cm(9.96), Cm(20.71), Cm(0.94))
+    tb.rotation = 270
+    tf = tb.text_frame
+    tf.clear()
+    p = tf.paragraphs[0]
+    p.alignment = PP_ALIGN.CENTER
+    r = p.add_run()
+    r.text = "PROOF OF POSTING"
+    r.font.name = "Montserrat"
+    r.font.size = Pt(16)
+    r.font.bold = True
+    r.font.color.rgb = PURPLE
+
+    # Site + Live Date labels/values per cell
+    cells = []
+    size = layout.caption_pt
+    for index, (cell, picture) in enumerate(zip(layout.cells, pictures)):
+        details, _ = photos[index] if index < len(photos) else photos[0]
+        site_label = _add_text(slide, *cell.site_label, "Site:", size=size, color=GAWK_GREEN)
+        site = _add_text(slide, *cell.site, details.site_name, size=size)
+        date_label = _add_text(slide, *cell.date_label, "Live Date:", size=size, color=GAWK_GREEN)
+        live_date = _add_text(slide, *cell.date, details.live_date_display, size=size)
+        shapes = [picture, site_label._element, site._element]
+        shapes += [date_label._element, live_date._element]
+        cells.append(
+            {
+                "picture": picture,
+                "site": site._element,
+                "live_date": live_date._element,
+                "shapes": shapes,
+            }
         )
 
-        # Main PoP image, scaled to fit the 24.89 x 12.87cm box at (3.4, 4.45)
-        img = Image.open(img_path)
-        iw, ih = img.size
-        img_aspect = iw / ih
-        box_aspect = 24.89 / 12.87
+    return {"background": background._element, "logo": logo._element, "cells": cells}
+
+
+class _MediaSpool:
+    """
+    Where a memory-budgeted build keeps media once the process has reached
+    its budget: an append-only temporary file, read back part by part when
+    the deck is written.
+    """
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.held = 0
+        self.spilled = 0
+        self._file = None
+
+    def store(self, blob: bytes) -> Tuple[int, int] | None:
+        """
+        Spill `blob` and return its (offset, length), or return None when it
+        still fits in memory. Once spilling starts, every later blob spills.
+        """
+        if self._file is None:
+            rss = current_rss()
+            used = rss if rss is not None else self.held
+            if used + len(blob) <= self.budget:
+                self.held += len(blob)
+                return None
+            self._file = tempfile.TemporaryFile(prefix="pop_media_")
+            logger.info("Memory budget reached; spooling media to disk")
+
+        offset = self._file.seek(0, io.SEEK_END)
+        self._file.write(blob)
+        self.spilled += len(blob)
+        return offset, len(blob)
+
+    def read(self, ref: Tuple[int, int]) -> bytes:
+        offset, length = ref
+        self._file.seek(offset)
+        return self._file.read(length)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+
+class _SpooledImagePart(ImagePart):
+    """An image part whose bytes stay in a _MediaSpool until they are read."""
 
-        if img_aspect > box_aspect:
-            new_width = Cm(24.89)
-            new_height = Cm(24.89 / img_aspect)
+    def __init__(self, partname, content_type, package, spool, ref, filename, sha1):
+        super().__init__(partname, content_type, package, b"", filename)
+        self._spool = spool
+        self._ref = ref
+        # Seed python-pptx's lazy SHA-1 so looking the part up doesn't read it back
+        self.__dict__["sha1"] = sha1
+
+    @property
+    def _blob(self) -> bytes:
+        return self._spool.read(self._ref)
+
+    @_blob.setter
+    def _blob(self, value) -> None:
+        # Part.__init__ stores the empty placeholder; the bytes are in the spool
+        pass
+
+
+class _MediaRegistry:
+    """
+    The image parts of one deck, keyed by SHA-1.
+
+    Seeded once from the package, so a repeated photo is found with a dict
+    lookup instead of python-pptx walking every part of the deck, and new
+    media names are handed out without rescanning the package. With a
+    `spool`, new parts past the memory budget keep their bytes on disk.
+    """
+
+    def __init__(self, package, spool: _MediaSpool | None = None):
+        self._package = package
+        self._spool = spool
+        self._parts: dict = {}
+        self._used_idx: set = set()
+        self._next_idx = 1
+        self.repeats = 0
+        self.bytes_saved = 0
+
+        for part in package.iter_parts():
+            if part.partname.startswith("/ppt/media/image") and part.partname.idx is not None:
+                self._used_idx.add(part.partname.idx)
+            if isinstance(part, ImagePart):
+                self._parts.setdefault(part.sha1, part)
+
+    def get_or_add(self, image: PreparedImage) -> ImagePart:
+        part = self._parts.get(image.sha1)
+        if part is not None:
+            self.repeats += 1
+            self.bytes_saved += len(image.blob)
+            return part
+
+        pptx_image = PptxImage(image.blob, image.filename)
+        partname = PackURI(f"/ppt/media/image{self._take_idx()}.{pptx_image.ext}")
+        ref = self._spool.store(image.blob) if self._spool is not None else None
+        if ref is None:
+            part = ImagePart(
+                partname, pptx_image.content_type, self._package, image.blob, image.filename
+            )
         else:
-            new_height = Cm(12.87)
-            new_width = Cm(12.87 * img_aspect)
-
-        slide.shapes.add_picture(
-            str(img_path),
-            Cm(3.4),
-            Cm(4.45),
-            width=new_width,
-            height=new_height,
-        )
+            part = _SpooledImagePart(
+                partname,
+                pptx_image.content_type,
+                self._package,
+                self._spool,
+                ref,
+                image.filename,
+                image.sha1,
+            )
+        self._parts[image.sha1] = part
+        return part
+
+    def _take_idx(self) -> int:
+        # Lowest free number, the same one python-pptx would pick
+        while self._next_idx in self._used_idx:
+            self._next_idx += 1
+        self._used_idx.add(self._next_idx)
+        return self._next_idx
+
+
+class _SlideSkeleton:
+    """
+    Stamps out PoP slides from a precompiled shape tree.
+
+    The first slide is drawn shape by shape with `_draw_pop_slide`, every cell
+    of the photo layout filled. Its shape tree is then kept as XML, together
+    with the background and logo image parts it points at, and every following
+    slide is a deep copy of that tree with only the site names, live dates and
+    photos filled in, and the shapes of any cells it has no photo for removed.
+    Photos go through a `_MediaRegistry`, so repeated photos share one image
+    part (kept in `spool` once over the memory budget, when one is given).
+    """
+
+    def __init__(
+        self,
+        prs: Presentation,
+        layout,
+        photo_layout: PhotoLayout,
+        spool: _MediaSpool | None = None,
+    ):
+        self._prs = prs
+        self._layout = layout
+        self._photo_layout = photo_layout
+        self._spool = spool
+        self._sp_tree = None
+        self._index: dict = {}
+        self._cells: list = []
+        self._background_part = None
+        self._logo_part = None
+        self.media = None
+        self._slide_idx = {
+            rel.target_part.partname.idx
+            for rel in prs.part.rels.values()
+            if rel.reltype == RT.SLIDE
+        }
+
+    def add_slide(self, photos: list) -> str:
+        """
+        Append a PoP slide showing the (details, PreparedImage) `photos`, at
+        most one per cell, and return its relationship id.
+        """
+        if self._sp_tree is None:
+            rId, slide = self._new_slide()
+            slide.shapes.clone_layout_placeholders(self._layout)
+            self._compile(slide, _draw_pop_slide(slide, self._photo_layout, photos))
+            self._drop_cells(slide.shapes._spTree, list(slide.shapes._spTree), len(photos))
+            return rId
+
+        rId, slide = self._new_slide()
+
+        # Same relationship order as the drawn slide: background, photos, logo
+        part = slide.part
+        background_rId = part.relate_to(self._background_part, RT.IMAGE)
+        image_rIds = [part.relate_to(self.media.get_or_add(image), RT.IMAGE) for _, image in photos]
+        logo_rId = part.relate_to(self._logo_part, RT.IMAGE)
+
+        sp_tree = deepcopy(self._sp_tree)
+        shapes = list(sp_tree)
+        shapes[self._index["background"]].blipFill.blip.rEmbed = background_rId
+        shapes[self._index["logo"]].blipFill.blip.rEmbed = logo_rId
+
+        for index, (cell, (details, image), image_rId) in enumerate(
+            zip(self._cells, photos, image_rIds)
+        ):
+            picture = shapes[cell["picture"]]
+            picture.nvPicPr.cNvPr.set("descr", image.filename)
+            picture.blipFill.blip.rEmbed = image_rId
+            xfrm = picture.spPr.xfrm
+            xfrm.x, xfrm.y, xfrm.cx, xfrm.cy = self._photo_layout.place(index, image.size)
+
+            shapes[cell["site"]].xpath(".//a:t")[0].text = details.site_name
+            shapes[cell["live_date"]].xpath(".//a:t")[0].text = details.live_date_display
+        self._drop_cells(sp_tree, shapes, len(photos))
 
-        # Gawk logo top-right
-        slide.shapes.add_picture(
-            str(LOGO_PATH),
-            Cm(23.8),
-            Cm(1.52),
-            width=Cm(4.49),
-            height=Cm(1.46),
+        cSld = slide._element.cSld
+        cSld.replace(cSld.spTree, sp_tree)
+        return rId
+
+    def add_stamped_slide(self, sp_tree_xml: bytes, images: List[PreparedImage]) -> str:
+        """
+        Append a slide another skeleton stamped (see `_stamp_shard`): its shape
+        tree as XML, with the photos it points at. Returns its relationship id.
+        """
+        rId, slide = self._new_slide()
+
+        # The shard's tree refers to these relationship ids, related in this order
+        part = slide.part
+        part.relate_to(self._background_part, RT.IMAGE)
+        for image in images:
+            part.relate_to(self.media.get_or_add(image), RT.IMAGE)
+        part.relate_to(self._logo_part, RT.IMAGE)
+
+        cSld = slide._element.cSld
+        cSld.replace(cSld.spTree, parse_xml(sp_tree_xml))
+        return rId
+
+    def remove_slide(self, rId: str) -> None:
+        """Take a slide added by `add_slide` back out of the deck."""
+        sldIdLst = self._prs.slides._sldIdLst
+        sldIdLst.remove(next(sldId for sldId in sldIdLst if sldId.rId == rId))
+        self._slide_idx.discard(self._prs.part.related_part(rId).partname.idx)
+        self._prs.part.drop_rel(rId)
+
+    def _new_slide(self):
+        # python-pptx names new slides len(sldIdLst) + 1, which can clash with
+        # an existing part once slides have been removed; take the lowest free
+        # number instead (the same name python-pptx picks when nothing was removed).
+        idx = 1
+        while idx in self._slide_idx:
+            idx += 1
+        self._slide_idx.add(idx)
+
+        partname = PackURI(f"/ppt/slides/slide{idx}.xml")
+        slide_part = SlidePart.new(partname, self._prs.part.package, self._layout.part)
+        rId = self._prs.part.relate_to(slide_part, RT.SLIDE)
+        self._prs.slides._sldIdLst.add_sldId(rId)
+        return rId, slide_part.slide
+
+    def _drop_cells(self, sp_tree, shapes: list, filled: int) -> None:
+        # Cells past the photos a slide has are left empty
+        for cell in self._cells[filled:]:
+            for index in cell["shapes"]:
+                sp_tree.remove(shapes[index])
+
+    def _compile(self, slide, shapes: dict) -> None:
+        sp_tree = slide.shapes._spTree
+        children = list(sp_tree)
+        self._index = {role: children.index(shapes[role]) for role in ("background", "logo")}
+        self._cells = [
+            {
+                "picture": children.index(cell["picture"]),
+                "site": children.index(cell["site"]),
+                "live_date": children.index(cell["live_date"]),
+                "shapes": [children.index(el) for el in cell["shapes"]],
+            }
+            for cell in shapes["cells"]
+        ]
+        self._background_part = slide.part.related_part(shapes["background"].blip_rId)
+        self._logo_part = slide.part.related_part(shapes["logo"].blip_rId)
+        self._sp_tree = deepcopy(sp_tree)
+        self.media = _MediaRegistry(self._prs.part.package, self._spool)
+
+
+class _TemplateCache:
+    """
+    Keeps the report template in memory, validated, once per process.
+
+    The file is re-read only when its mtime or size changes. Each caller gets
+    a fresh Presentation opened from the pristine in-memory package, so no
+    report ever touches the disk copy or another report's slides.
+    """
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._key = None
+        self._blob = None
+
+    def get(self) -> Presentation:
+        return Presentation(io.BytesIO(self._load()))
+
+    def warm(self) -> None:
+        self._load()
+
+    def _load(self) -> bytes:
+        stat = self._path.stat()
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if key != self._key:
+                blob = self._path.read_bytes()
+                _validate_template(Presentation(io.BytesIO(blob)))
+                self._blob, self._key = blob, key
+            return self._blob
+
+
+def _validate_template(prs: Presentation) -> None:
+    if len(prs.slide_layouts) <= BLANK_LAYOUT_INDEX:
+        raise ValueError(
+            f"Template has no slide layout {BLANK_LAYOUT_INDEX}; cannot build PoP slides."
         )
+    if len(prs.slides) < 3:
+        raise ValueError("Template needs its front, example and closing slides.")
+
+
+_template_cache = _TemplateCache(TEMPLATE_PATH)
+
+
+def load_template() -> Presentation:
+    """Return an independent copy of the report template."""
+    return _template_cache.get()
+
+
+def warm_template_cache() -> None:
+    """Load and validate the template ahead of the first report (e.g. at server startup)."""
+    _template_cache.warm()
+
+
+def report_filename(info: PhotoName) -> str:
+    """Suggested download name for the report whose first photo parsed to `info`."""
+    safe_client = info.client.strip()
+    safe_month = info.month_year
+    return f"PoP Report - {safe_client} ({safe_month}).pptx"
+
+
+def collect_images(image_paths, trace: BuildTrace | None = None) -> list:
+    """Expand directories, keep JPG/PNG sources and sort them into slide order."""
+    trace = trace if trace is not None else NULL_TRACE
+
+    # In-memory files (UploadedFile, NamedBuffer) are used as they are
+    image_files: list = []
+    with trace.span("scan"):
+        for p in image_paths:
+            if hasattr(p, "getvalue"):
+                if Path(p.name).suffix.lower() in [".jpg", ".jpeg", ".png"]:
+                    image_files.append(p)
+                continue
+            p = Path(p)
+            if p.is_dir():
+                image_files.extend(
+                    f for f in p.glob("*") if f.suffix.lower() in [".jpg", ".jpeg", ".png"]
+                )
+            elif p.suffix.lower() in [".jpg", ".jpeg", ".png"]:
+                image_files.append(p)
+
+    with trace.span("sort"):
+        image_files = sorted(image_files, key=extract_live_date_priority)
+
+    if not image_files:
+        raise FileNotFoundError("No JPG, JPEG, or PNG files found for PoP generation.")
+    return image_files
+
+
+class BuildCancelled(Exception):
+    """Raised inside a build whose `cancel` event was set."""
+
+
+class ReportBuilder:
+    """
+    Builds a PoP report and keeps it around for the next build.
+
+    Rebuilding with an updated photo list only prepares and stamps slides for
+    photos that are new or changed (a slide is keyed by filename plus content
+    hash), drops slides whose photos are gone and re-sequences the rest in
+    `extract_live_date_priority` order. If the first photo's client, campaign
+    or month changes, the deck starts over from the template.
+
+    With `shards` above 1, a build with many new slides splits them into up to
+    that many contiguous runs. The first is stamped here while worker processes
+    prepare and stamp the rest from their own copy of the template; their
+    shape trees are then merged into this deck in order, with slide parts,
+    relationships and media named exactly as a single-process build names them.
+
+    With a `memory_budget` (bytes of resident memory), photos are prepared one
+    at a time in this process, without workers or shards, and once the process
+    reaches the budget every further image part keeps its bytes in a temporary
+    file until the deck is written.
+
+    `photo_layout` (a PHOTO_LAYOUTS name or a PhotoLayout) sets how many photos
+    share a slide; cells are filled in `extract_live_date_priority` order. With
+    several per slide, a slide is keyed by all of its photos, so a change
+    re-stamps the slides from there on, reusing the photos already prepared.
+    """
+
+    def __init__(
+        self,
+        image_preset=DEFAULT_IMAGE_PRESET,
+        workers: int | None = None,
+        shards: int | None = None,
+        memory_budget: int | None = None,
+        photo_layout=DEFAULT_PHOTO_LAYOUT,
+    ):
+        resolve_preset(image_preset)
+        self.image_preset = image_preset
+        self.photo_layout = photo_layout
+        self._photo_layout = resolve_photo_layout(photo_layout)
+        self.memory_budget = memory_budget
+        self.workers = 1 if memory_budget else workers
+        self.shards = 1 if memory_budget else shards or 1
+        self._spool = None
+        self._prs = None
+        self._header = None
+        self._skeleton = None
+        self._front = None
+        self._closing = None
+        self._slides: dict = {}
+        self._images: dict = {}
+
+    def build(
+        self,
+        image_paths,
+        progress: Callable[[dict], None] | None = None,
+        cancel: threading.Event | None = None,
+        trace: BuildTrace | None = None,
+        prepared: dict | None = None,
+        digests: dict | None = None,
+    ) -> Tuple[Presentation, str]:
+        """
+        Bring the deck up to date with `image_paths`; return (prs, suggested_filename).
+
+        `progress` receives {"stage", "slides_done", "slides_total"} as the
+        build moves through "preparing" and "building" (once per slide); the
+        counts are of photos, which is slides in the single layout.
+        Setting `cancel` stops the build between slides with BuildCancelled.
+        `trace` (a BuildTrace) records a span per stage and per-slide timings.
+
+        `prepared` maps (filename, SHA-1) to photos already prepared with this
+        builder's preset for its layout's photo box (IMAGE_BOX_CM in the single
+        layout; e.g. `Preprocessor.prepared()`); those are used as they are
+        instead of being prepared again. `digests` maps sources to their
+        `source_digest` where the caller has already hashed them.
+        """
+        trace = trace if trace is not None else NULL_TRACE
+        image_files = collect_images(image_paths, trace)
+
+        with trace.span("parse"):
+            names = parse_photo_names(image_files)
+        first_info = names[0]
+        if not first_info.valid:
+            raise ValueError("First image filename is invalid. Cannot determine client/campaign/date.")
+
+        header = first_info.report_key
+        if header != self._header:
+            with trace.span("template_load"):
+                self._start(first_info)
+            self._header = header
+
+        wanted = []
+        seen: dict = {}
+        digests = digests or {}
+        with trace.span("hash"):
+            for source, details in zip(image_files, names):
+                if details.valid:
+                    # The same photo listed twice still gets two slides
+                    digest = digests.get(source) or source_digest(source)
+                    key = (Path(source.name).name, digest)
+                    seen[key] = seen.get(key, -1) + 1
+                    wanted.append(((*key, seen[key]), source, details))
+
+        def report(stage: str, done: int) -> None:
+            if progress:
+                progress({"stage": stage, "slides_done": done, "slides_total": len(wanted)})
+
+        # Photos fill the layout's cells in order; a slide is keyed by its photos
+        per_slide = self._photo_layout.per_slide
+        slides = []
+        for i in range(0, len(wanted), per_slide):
+            photos = wanted[i : i + per_slide]
+            slides.append((tuple(key for key, _, _ in photos), photos))
+
+        try:
+            # Drop slides whose photos were removed or changed
+            keep = {key for key, _ in slides}
+            stale = [k for k in self._slides if k not in keep]
+            with trace.span("remove_slides"):
+                for key in stale:
+                    self._skeleton.remove_slide(self._slides.pop(key))
+
+            # Prepare and stamp only the slides this deck hasn't seen
+            new = [(key, photos) for key, photos in slides if key not in self._slides]
+            done = len(wanted) - sum(len(photos) for _, photos in new)
+            trace.count("slides_removed", len(stale))
+            trace.count("slides_reused", len(slides) - len(new))
+            trace.count("slides_added", len(new))
+            report("preparing", done)
+            # Photos already on this deck's slides aren't prepared again either
+            ready = {**(prepared or {}), **self._images}
+            with trace.span("slides"):
+                shards = min(self.shards, len(new) // SHARD_MIN_SLIDES)
+                if shards > 1:
+                    self._stamp_sharded(new, shards, done, report, cancel, trace, ready)
+                else:
+                    self._stamp(new, self.workers, done, report, cancel, trace, ready)
+
+            with trace.span("sequence"):
+                self._sequence([self._slides[key] for key, _ in slides])
+            in_use = {key[:2] for key, _, _ in wanted}
+            self._images = {k: v for k, v in self._images.items() if k in in_use}
+        except BaseException:
+            # Half-applied changes; start from the template next time
+            self._header = None
+            raise
+
+        if self._spool is not None:
+            trace.gauge("media_spilled_bytes", self._spool.spilled)
+        if self._skeleton.media is not None:
+            trace.count("media_repeats", self._skeleton.media.repeats)
+            trace.count("media_bytes_saved", self._skeleton.media.bytes_saved)
+            logger.info(
+                "Media dedup: %d repeated images, %d bytes saved",
+                self._skeleton.media.repeats,
+                self._skeleton.media.bytes_saved,
+            )
+
+        return self._prs, report_filename(first_info)
 
-        # Gawk green vertical strip
-        rect = slide.shapes.add_shape(
-            1,  # MSO_SHAPE_RECTANGLE
-            Cm(0),
-            Cm(0),
-            Cm(1.22),
-            Cm(21),
+    def close(self) -> None:
+        """Drop the media spool of a memory-budgeted build; the deck can't be saved after this."""
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+            self._header = None
+
+    def _stamp(self, new: list, workers, done: int, report, cancel, trace, ready=None) -> int:
+        """
+        Prepare and stamp the `new` slides in this process; return the photos
+        done. Photos found in `ready` (see `build`'s `prepared`) aren't prepared again.
+        """
+        ready = ready or {}
+        todo = [
+            (key, source) for _, photos in new for key, source, _ in photos if key[:2] not in ready
+        ]
+        images = prepare_images(
+            [source for _, source in todo],
+            self._photo_layout.box_cm,
+            self.image_preset,
+            workers,
+            [key[1] for key, _ in todo],
         )
-        rect.fill.solid()
-        rect.fill.fore_color.rgb = GAWK_GREEN
-        rect.line.fill.background()
-
-        # Vertical 'PROOF OF POSTING'
-        tb = slide.shapes.add_textbox(Cm(-9.73), Cm(9.96), Cm(20.71), Cm(0.94))
-        tb.rotation = 270
-        tf = tb.text_frame
-        tf.clear()
-        p = tf.paragraphs[0]
-        p.alignment = PP_ALIGN.CENTER
-        r = p.add_run()
-        r.text = "PROOF OF POSTING"
-        r.font.name = "Montserrat"
-        r.font.size = Pt(16)
-        r.font.bold = True
-        r.font.color.rgb = PURPLE
-
-        # Site + Live Date labels/values
-        _add_text(
-            slide,
-            Cm(3.06),
-            Cm(2.5),
-            Cm(3.09),
-            Cm(1.24),
-            "Site:",
-            color=GAWK_GREEN,
+        try:
+            for slide_key, photos in new:
+                if cancel is not None and cancel.is_set():
+                    raise BuildCancelled("Build cancelled.")
+                started = time.perf_counter()
+                placed = [
+                    (details, ready.get(key[:2]) or next(images)) for key, _, details in photos
+                ]
+                prepared = time.perf_counter()
+                self._slides[slide_key] = self._skeleton.add_slide(placed)
+                self._remember(photos, [image for _, image in placed])
+                trace.record("prepare_image", prepared - started)
+                trace.record("stamp_slide", time.perf_counter() - prepared)
+                done += len(photos)
+                report("building", done)
+        finally:
+            # Shuts the worker pool down now rather than whenever it is collected
+            images.close()
+        return done
+
+    def _stamp_sharded(
+        self, new: list, shards: int, done: int, report, cancel, trace, ready=None
+    ) -> None:
+        """
+        Stamp the first run of `new` here and the rest on shard processes, then
+        merge. Shards prepare all of their photos themselves.
+        """
+        size = math.ceil(len(new) / shards)
+        runs = [new[i : i + size] for i in range(0, len(new), size)]
+        pool = process_pool(len(runs) - 1)
+        futures = [
+            pool.submit(
+                _stamp_shard,
+                [
+                    [(portable_source(source), details) for _, source, details in photos]
+                    for _, photos in run
+                ],
+                self.image_preset,
+                self.photo_layout,
+            )
+            for run in runs[1:]
+        ]
+        try:
+            # Photos are prepared in-process; the shards already use the other CPUs
+            done = self._stamp(runs[0], 1, done, report, cancel, trace, ready)
+            for run, future in zip(runs[1:], futures):
+                while not wait([future], timeout=0.5).done:
+                    if cancel is not None and cancel.is_set():
+                        raise BuildCancelled("Build cancelled.")
+                for (slide_key, photos), (sp_tree, images) in zip(run, future.result()):
+                    if cancel is not None and cancel.is_set():
+                        raise BuildCancelled("Build cancelled.")
+                    started = time.perf_counter()
+                    self._slides[slide_key] = self._skeleton.add_stamped_slide(sp_tree, images)
+                    self._remember(photos, images)
+                    trace.record("merge_slide", time.perf_counter() - started)
+                    done += len(photos)
+                    report("building", done)
+        except BaseException:
+            # Return straight away; shards already running finish on their own
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        pool.shutdown()
+
+    def _remember(self, photos: list, images: list) -> None:
+        # Slides holding several photos are re-stamped when a photo before them
+        # changes; keep their photos for that, unless memory is budgeted
+        if self._photo_layout.per_slide > 1 and self._spool is None:
+            for (key, _, _), image in zip(photos, images):
+                self._images[key[:2]] = image
+
+    def _start(self, first_info: PhotoName) -> None:
+        prs = load_template()
+        _add_front_slide_content(prs, first_info)
+
+        # Template slides: front, example (dropped), closing 'Gotta love rectangles'
+        template_ids = list(prs.slides._sldIdLst)
+        self._front, self._closing = template_ids[0], template_ids[2]
+
+        if self._spool is not None:
+            self._spool.close()
+        self._spool = _MediaSpool(self.memory_budget) if self.memory_budget else None
+
+        self._prs = prs
+        self._skeleton = _SlideSkeleton(
+            prs, prs.slide_layouts[BLANK_LAYOUT_INDEX], self._photo_layout, self._spool
         )
-        _add_text(
-            slide,
-            Cm(5.36),
-            Cm(2.5),
-            Cm(13.25),
-            Cm(1.24),
-            details["site_name"],
+        self._slides = {}
+        self._images = {}
+
+    def _sequence(self, rIds: list) -> None:
+        """Order the deck as front slide, PoP slides in `rIds` order, closing slide."""
+        sldIdLst = self._prs.slides._sldIdLst
+        by_rId = {sldId.rId: sldId for sldId in sldIdLst}
+        for sldId in list(sldIdLst):
+            sldIdLst.remove(sldId)
+        for sldId in [self._front, *(by_rId[rId] for rId in rIds), self._closing]:
+            sldIdLst.append(sldId)
+
+
+def _stamp_shard(slides: list, image_preset, photo_layout) -> list:
+    """
+    Shard worker: prepare and stamp PoP slides on a fresh copy of the template.
+    `slides` holds a list of (source, PhotoName) per slide. Returns (shape tree
+    XML, the slide's PreparedImages) per slide, in order.
+    """
+    layout = resolve_photo_layout(photo_layout)
+    prs = load_template()
+    skeleton = _SlideSkeleton(prs, prs.slide_layouts[BLANK_LAYOUT_INDEX], layout)
+    images = prepare_images(
+        [source for photos in slides for source, _ in photos], layout.box_cm, image_preset, 1
+    )
+    stamped = []
+    for photos in slides:
+        placed = [(details, next(images)) for _, details in photos]
+        rId = skeleton.add_slide(placed)
+        sp_tree = prs.part.related_part(rId)._element.cSld.spTree
+        stamped.append((etree.tostring(sp_tree), [image for _, image in placed]))
+    return stamped
+
+
+def generate_presentation_bytes(
+    image_paths: List[Path],
+    image_preset=DEFAULT_IMAGE_PRESET,
+    workers: int | None = None,
+    progress: Callable[[dict], None] | None = None,
+    cancel: threading.Event | None = None,
+    trace: BuildTrace | None = None,
+    shards: int | None = None,
+    memory_budget: int | None = None,
+    photo_layout=DEFAULT_PHOTO_LAYOUT,
+) -> Tuple[bytes, str]:
+    """
+    Core PoP logic reproduced from the desktop GUI script,
+    but saving to an in-memory bytes object instead of using file dialogs.
+
+    `image_paths` may mix files, directories and in-memory files with a
+    `.name` and `getvalue()` (UploadedFile, NamedBuffer).
+
+    `image_preset` picks how photos are embedded: a name from IMAGE_PRESETS,
+    a {"dpi", "quality"} dict, or "original" to embed the files byte for byte.
+    Photos are prepared on `workers` processes (default: one per CPU).
+    For large decks prefer `generate_presentation_file`, which never holds
+    the finished .pptx in memory.
+
+    `progress` receives a dict with "stage" ("preparing", "building",
+    "saving", "done"), "slides_done", "slides_total" and "bytes_written"
+    whenever one of them changes. Setting the `cancel` event stops the build
+    at the next slide (or during saving) with BuildCancelled.
+
+    Pass a BuildTrace as `trace` to get the time spent in each stage and
+    per-slide histograms; its sinks run once the deck is saved.
+
+    For very large decks, `shards` > 1 stamps slides on that many processes
+    and merges them into one deck identical to the single-process one (see
+    ReportBuilder).
+
+    `memory_budget` (bytes) builds within a resident-memory budget, as
+    described for `generate_presentation_file`.
+
+    `photo_layout` names how many photos go on each slide (see PHOTO_LAYOUTS):
+    "single" as the desktop script did, or a 2-, 4- or 6-up grid.
+    """
+    # With a budget the deck is staged in a file, so only the returned copy is in memory
+    f = tempfile.TemporaryFile() if memory_budget else io.BytesIO()
+    with f:
+        _, output_name = generate_presentation_file(
+            image_paths,
+            f,
+            image_preset,
+            workers,
+            progress=progress,
+            cancel=cancel,
+            trace=trace,
+            shards=shards,
+            memory_budget=memory_budget,
+            photo_layout=photo_layout,
         )
-        _add_text(
-            slide,
-            Cm(3.06),
-            Cm(18),
-            Cm(4.76),
-            Cm(1.24),
-            "Live Date:",
-            color=GAWK_GREEN,
+        return f.read() if memory_budget else f.getvalue(), output_name
+
+
+def generate_presentation_file(
+    image_paths: List[Path],
+    out=None,
+    image_preset=DEFAULT_IMAGE_PRESET,
+    workers: int | None = None,
+    progress: Callable[[dict], None] | None = None,
+    cancel: threading.Event | None = None,
+    trace: BuildTrace | None = None,
+    shards: int | None = None,
+    memory_budget: int | None = None,
+    photo_layout=DEFAULT_PHOTO_LAYOUT,
+) -> Tuple[BinaryIO | Path, str]:
+    """
+    Same as `generate_presentation_bytes`, but writes the deck to `out`.
+
+    `out` may be a path or a writable binary file object. Without one, the
+    deck goes to a SpooledTemporaryFile that rolls over to disk past
+    SPOOL_MAX_BYTES. Returns (out, suggested_filename); seekable file objects
+    are rewound ready for reading and belong to the caller to close.
+
+    With a `memory_budget` in bytes, photos are handled strictly one at a
+    time, media past the budget is spooled to disk (see ReportBuilder) and a
+    spooled `out` rolls over at BUDGET_SPOOL_SHARE of the budget. The peak
+    resident memory of the build is logged, set as the `trace` gauge
+    "peak_rss_bytes" and sent with the "done" progress event.
+    """
+    state = {"stage": "preparing", "slides_done": 0, "slides_total": 0, "bytes_written": 0}
+
+    def relay(event: dict) -> None:
+        state.update(event)
+        progress(dict(state))
+
+    relay = relay if progress else None
+    if memory_budget and out is None:
+        out = tempfile.SpooledTemporaryFile(
+            max_size=min(SPOOL_MAX_BYTES, int(memory_budget * BUDGET_SPOOL_SHARE)), suffix=".pptx"
         )
-        _add_text(
-            slide,
-            Cm(7.79),
-            Cm(18),
-            Cm(12.35),
-            Cm(1.24),
-            details["live_date_display"],
+
+    builder = ReportBuilder(image_preset, workers, shards, memory_budget, photo_layout)
+    memory = PeakMemory() if memory_budget else None
+    try:
+        with memory or nullcontext():
+            prs, output_name = builder.build(image_paths, relay, cancel, trace)
+            out = save_presentation(prs, out, relay, cancel, trace)
+    finally:
+        builder.close()
+
+    done = {"stage": "done"}
+    if memory is not None and memory.peak is not None:
+        logger.info(
+            "Peak memory %.1f MB (budget %.1f MB)", memory.peak / 2**20, memory_budget / 2**20
         )
+        if trace is not None:
+            trace.gauge("peak_rss_bytes", memory.peak)
+        done["peak_rss_bytes"] = memory.peak
+    if relay:
+        relay(done)
+    if trace is not None:
+        trace.finish()
+    return out, output_name
+
+
+def save_presentation(
+    prs: Presentation,
+    out=None,
+    progress: Callable[[dict], None] | None = None,
+    cancel: threading.Event | None = None,
+    trace: BuildTrace | None = None,
+    xml_level: int = XML_DEFLATE_LEVEL,
+) -> BinaryIO | Path:
+    """
+    Write `prs` to `out` as described in `generate_presentation_file`; return `out`.
+    `progress` receives {"stage": "saving", "bytes_written"} about every
+    PROGRESS_BYTES; setting `cancel` aborts the write with BuildCancelled.
+    The write is recorded as the "save" span of `trace`. See `write_package`
+    for `xml_level`.
+    """
+    trace = trace if trace is not None else NULL_TRACE
+    if out is None:
+        out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, suffix=".pptx")
 
-    # Remove example slide (index 1) and move 'Gotta love rectangles' to the end
-    if len(prs.slides) >= 3:
-        prs.slides._sldIdLst.remove(prs.slides._sldIdLst[1])
-        final_slide = prs.slides._sldIdLst[1]
-        prs.slides._sldIdLst.remove(final_slide)
-        prs.slides._sldIdLst.append(final_slide)
+    with trace.span("save"):
+        if isinstance(out, (str, Path)):
+            out = Path(out)
+            with open(out, "wb") as f:
+                _save_with_progress(prs, f, progress, cancel, xml_level)
+        else:
+            _save_with_progress(prs, out, progress, cancel, xml_level)
+
+    if not isinstance(out, Path) and out.seekable():
+        out.seek(0)
+    return out
+
+
+def _save_with_progress(prs: Presentation, f: BinaryIO, progress, cancel, xml_level: int) -> None:
+    if progress is None and cancel is None:
+        write_package(prs, f, xml_level)
+        return
+    writer = _ProgressWriter(f, progress, cancel)
+    write_package(prs, writer, xml_level)
+    if progress:
+        progress({"stage": "saving", "bytes_written": writer.written})
+
+
+def write_package(prs: Presentation, f: BinaryIO, xml_level: int = XML_DEFLATE_LEVEL) -> None:
+    """
+    Write `prs` to the binary file `f` as a .pptx, part for part what
+    `prs.save` writes, but JPEG/PNG/GIF media are stored rather than deflated
+    again (they don't shrink) and XML is deflated at `xml_level` (0-9).
 
-    safe_client = first_info["client"].strip()
-    safe_month = first_info["month_year"]
-    output_name = f"PoP Report - {safe_client} ({safe_month}).pptx"
+    Parts go out in the same order as python-pptx writes them:
+    [Content_Types].xml, the package rels, then each part followed by its rels.
+    """
+    package = prs.part.package
+    parts = tuple(package.iter_parts())
+    with zipfile.ZipFile(
+        f, "w", zipfile.ZIP_DEFLATED, compresslevel=xml_level, strict_timestamps=False
+    ) as zf:
+        zf.writestr(CONTENT_TYPES_URI.membername, serialize_part_xml(_ContentTypesItem.xml_for(parts)))
+        zf.writestr(PACKAGE_URI.rels_uri.membername, package._rels.xml)
+        for part in parts:
+            if part.content_type in STORED_CONTENT_TYPES:
+                zf.writestr(part.partname.membername, part.blob, compress_type=zipfile.ZIP_STORED)
+            else:
+                zf.writestr(part.partname.membername, part.blob)
+            if part._rels:
+                zf.writestr(part.partname.rels_uri.membername, part.rels.xml)
+
+
+class _ProgressWriter:
+    """Wraps a binary file, reporting bytes written and honouring `cancel`."""
+
+    def __init__(self, f: BinaryIO, progress, cancel):
+        self._f = f
+        self._progress = progress
+        self._cancel = cancel
+        self.written = 0
+        self._reported = 0
 
-    bio = io.BytesIO()
-    prs.save(bio)
-    bio.seek(0)
-    return bio.read(), output_name
+    def write(self, data) -> int:
+        if self._cancel is not None and self._cancel.is_set():
+            raise BuildCancelled("Build cancelled.")
+        n = self._f.write(data)
+        self.written += len(data)
+        if self._progress and self.written - self._reported >= PROGRESS_BYTES:
+            self._reported = self.written
+            self._progress({"stage": "saving", "bytes_written": self.written})
+        return n
 
+    def __getattr__(self, name):
+        return getattr(self._f, name)
 
-def generate_presentation_from_uploads(uploaded_files) -> Tuple[bytes, str]:
+
+def generate_presentation_from_uploads(
+    uploaded_files,
+    image_preset=DEFAULT_IMAGE_PRESET,
+    workers: int | None = None,
+    progress: Callable[[dict], None] | None = None,
+    cancel: threading.Event | None = None,
+) -> Tuple[bytes, str]:
     """
     Wrapper for Streamlit: takes a list of UploadedFile objects and returns
-    (pptx_bytes, suggested_filename).
+    (pptx_bytes, suggested_filename). Uploads are read straight from memory.
     """
-    temp_dir = SCRIPT_DIR / "uploaded_pop_images"
-    temp_dir.mkdir(exist_ok=True)
+    return generate_presentation_bytes(
+        list(uploaded_files),
+        image_preset=image_preset,
+        workers=workers,
+        progress=progress,
+        cancel=cancel,
+    )
 
-    paths: list[Path] = []
-    for uf in uploaded_files:
-        dest = temp_dir / uf.name
-        with open(dest, "wb") as f:
-            f.write(uf.getbuffer())
-        paths.append(dest)
 
-    return generate_presentation_bytes(paths)
\ No newline at end of file
+def generate_presentation_file_from_uploads(
+    uploaded_files,
+    out=None,
+    image_preset=DEFAULT_IMAGE_PRESET,
+    workers: int | None = None,
+    progress: Callable[[dict], None] | None = None,
+    cancel: threading.Event | None = None,
+) -> Tuple[BinaryIO | Path, str]:
+    """
+    Wrapper for Streamlit: takes a list of UploadedFile objects and writes the
+    deck to `out` (see `generate_presentation_file`).
+    """
+    return generate_presentation_file(
+        list(uploaded_files),
+        out,
+        image_preset=image_preset,
+        workers=workers,
+        progress=progress,
+        cancel=cancel,
+    )